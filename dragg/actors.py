@@ -0,0 +1,82 @@
+import numpy as np
+from multiprocess import Process, Pipe
+
+from dragg.mpc_batch import MPCBatch
+
+def run_actor(conn, homes, keys):
+    """
+    Main loop of an actor process. Owns a shard of homes for the whole run
+    and runs them as one MPCBatch for every (timestep, reward price) message,
+    replying with the values of keys of each home of the shard (or the
+    exception raised). A message of None stops the actor.
+    :return: None
+    """
+    batch = MPCBatch(homes)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        timestep, reward_price = msg
+        try:
+            batch.run_batch(timestep, reward_price)
+            conn.send(np.array([[float(home.optimal_vals.get(k, np.nan)) for k in keys] for home in homes]))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+class HomeActors:
+    def __init__(self, homes, n_actors, keys):
+        """
+        Long-lived worker processes, each owning a fixed shard of homes for the
+        whole run. The homes are sent to the actors once; every timestep the
+        actors only receive the timestep and the reward price and keep the state
+        of their homes (e.g. parametrized problems, forecast noise) in memory.
+        params
+        homes: List of MPCCalc homes
+        n_actors: int, number of worker processes
+        keys: list of str, values of the homes (optimal_vals) replied every timestep
+        """
+        n_actors = max(1, min(int(n_actors), len(homes)))
+        shards = np.array_split(np.arange(len(homes)), n_actors)
+        self.conns = []
+        self.actors = []
+        for shard in shards:
+            parent_conn, child_conn = Pipe()
+            actor = Process(target=run_actor, args=(child_conn, [homes[i] for i in shard], list(keys)), daemon=True)
+            actor.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.actors.append(actor)
+
+    def step(self, timestep, reward_price):
+        """
+        Runs all homes for the timestep.
+        params
+        timestep: int, current timestep of the simulation
+        reward_price: list, reward price over the horizon
+        :return: np.array (homes x keys), results of all homes in the order of the homes (nan for missing values)
+        """
+        msg = (int(timestep), [float(rp) for rp in reward_price])
+        for conn in self.conns:
+            conn.send(msg)
+        results = [conn.recv() for conn in self.conns]
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+        return np.concatenate(results)
+
+    def close(self):
+        """
+        Stops all actors.
+        :return: None
+        """
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for actor in self.actors:
+            actor.join()
+        self.conns = []
+        self.actors = []
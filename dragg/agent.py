@@ -2,7 +2,7 @@ import os
 import sys
 import threading
 from queue import Queue
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import pandas as pd
 from datetime import datetime, timedelta
@@ -26,6 +26,7 @@ from pathos.pools import ProcessPool
 # Local
 from dragg.mpc_calc import MPCCalc
 from dragg.redis_client import RedisClient
+from dragg.executor import Executor
 from dragg.logger import Logger
 
 # class Experience:
@@ -59,6 +60,7 @@ class RLAgent(ABC):
         self.i = 0
         self.z_theta_mu = 0
         self.lam_theta = 0.01
+        self.executor = None # pool of workers for the experience batches, created on first use (or shared by setting it)
 
         self.rl_data = {} #self.set_rl_data()
         self.set_rl_data()
@@ -203,8 +205,9 @@ class RLAgent(ABC):
         if len(self.memory) > self.BATCH_SIZE:
             batch = random.sample(self.memory, self.BATCH_SIZE)
 
-            pool = ProcessPool(nodes=self.config['simulation']['n_nodes'])
-            batch_y = np.array(pool.map(self.process_exp, batch))
+            if self.executor is None:
+                self.executor = Executor.from_config(self.config)
+            batch_y = np.array(self.executor.map(self.process_exp, batch))
             batch_phi = np.array([self.state_action_basis(exp['state'],exp['action']) for exp in batch])
 
             clf = Ridge(alpha = 0.01)
@@ -212,6 +215,54 @@ class RLAgent(ABC):
             temp_theta = clf.coef_
             self.theta_q[:,self.i] = self.ALPHA_q * temp_theta + (1-self.ALPHA_q) * self.theta_q.flatten()
 
+    def __getstate__(self):
+        """
+        Leaves the executor out of the agent sent to its workers.
+        """
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    def close(self):
+        """
+        Stops the workers of the executor.
+        :return: None
+        """
+        if self.executor is not None:
+            self.executor.close()
+            self.executor = None
+
+    checkpoint_keys = ["theta_mu", "theta_q", "prev_state", "state", "next_state", "action", "next_action", "memory",
+        "cumulative_reward", "average_reward", "mu", "i", "z_theta_mu", "rl_data"]
+
+    def checkpoint_state(self):
+        """
+        State of the agent written with the checkpoints of the simulation (see
+        restore_state), including the random states of the exploration and of
+        the experience batches. The arrays, lists and dicts are copied (the
+        experiences and records themselves are never changed).
+        :return: dict
+        """
+        state = {k: copy(getattr(self, k)) for k in self.checkpoint_keys}
+        state["rl_data"] = {k: copy(v) for k, v in self.rl_data.items()}
+        state["random_state"] = np.random.get_state(legacy=False)
+        state["py_random_state"] = random.getstate()
+        return state
+
+    def restore_state(self, state):
+        """
+        Restores the state of checkpoint_state, e.g. to resume a simulation.
+        :return: None
+        """
+        for k in self.checkpoint_keys:
+            v = state[k]
+            setattr(self, k, np.array(v) if k in ["theta_mu", "theta_q", "z_theta_mu"] and v is not None else v)
+        random_state = state["random_state"]
+        random_state["state"]["key"] = np.array(random_state["state"]["key"], dtype=np.uint32)
+        np.random.set_state(random_state)
+        version, internal, gauss = state["py_random_state"]
+        random.setstate((version, tuple(internal), gauss))
+
     def update_policy(self):
         """
         Updates the mean of the Gaussian action selection policy.
@@ -5,12 +5,15 @@ import os
 import sys
 import threading
 from queue import Queue
+from copy import copy
 
 import pandas as pd
 from datetime import datetime, timedelta
 import time
 import numpy as np
 import json
+import uuid
+import hashlib
 import toml
 import random
 import names
@@ -21,8 +24,14 @@ import pathos
 from pathos.pools import ProcessPool
 
 # Local
-from dragg.mpc_calc import MPCCalc, manage_home
+from dragg.mpc_calc import MPCCalc, manage_home, manage_home_at
+from dragg.mpc_batch import MPCBatch, manage_batch
+from dragg.actors import HomeActors
+from dragg.executor import Executor
+from dragg.result_store import ResultStore
+from dragg.checkpoint import CheckpointWriter, CheckpointThread, load_checkpoints, load_state
 from dragg.redis_client import RedisClient
+from dragg.shared_data import publish_data, release_data
 from dragg.logger import Logger
 
 class Aggregator:
@@ -67,6 +76,26 @@ class Aggregator:
         self.redis_client = RedisClient()
         self.config = self._import_config()
         self.check_type = self.config['simulation']['check_type']  # One of: 'pv_only', 'base', 'battery_only', 'pv_battery', 'all'
+        self.engine = self.config['simulation'].get('engine', 'pool')  # One of: 'pool', 'batch', 'actors'
+        self.iteration_results = None  # values of the homes (collect_fields) replied by the actors, read by collect_home_data
+        self.actors = None  # HomeActors of the 'actors' engine, set by set_actors
+        self.executor = None  # Executor of the 'pool' engine, set by set_executor
+        self.deadline = float(self.config['simulation'].get('deadline', 0))  # s, per timestep for the 'pool' engine, 0 = wait for all homes
+        self.pending_claims = []  # (timestep, solves of the late homes still running) whose claims hash is kept, see prune_claims
+        self.env_data = self.config['simulation'].get('env_data', 'shared')  # One of: 'shared', 'redis'
+        self.env_desc = None  # descriptor of the environmental data published in shared memory
+        self.transport = self.config['simulation'].get('transport', 'redis')  # One of: 'redis', 'local'
+        self.redis_client.set_transport(self.transport)
+        self.run_id = self.config['simulation'].get('run_id') or uuid.uuid4().hex[:12]  # prefix of all redis keys of the simulation
+        self.redis_client.set_run_id(self.run_id)
+        self.collect_home_data_enabled = self.config['simulation'].get('collect_home_data', True)  # False: only the community totals are collected
+        self.resume = self.config['simulation'].get('resume', False)  # continue the run from the state of the last checkpoint
+        self.resumed_time = 0  # s, run time before the run was resumed
+        self.checkpoint_queue = int(self.config['simulation'].get('checkpoint_queue', 2))  # checkpoints waiting for the background writer, 0 = written in the simulation loop
+        self.checkpoint_thread = None  # CheckpointThread, set by set_checkpoints
+        self.check_transport()
+        self.check_warm_start()
+        self.check_parametrized()
 
         self.thermal_trend = None
         self.max_daily_temp = None
@@ -108,6 +137,40 @@ class Aggregator:
         self.log.logger.info(f"Set the version write out to {data['simulation']['named_version']}")
         return data
 
+    def check_transport(self):
+        """
+        The local transport keeps all data in the aggregator process, so the homes
+        must be run in the aggregator process as well (batch engine or the pool
+        engine with the thread executor).
+        :return: None
+        """
+        in_process = self.engine == 'batch' or self.engine == 'pool' and self.config['simulation'].get('executor', 'process') == 'thread'
+        if self.transport == 'local' and not in_process:
+            self.log.logger.error(f"The local transport requires the batch engine or the thread executor, not the {self.engine} engine.")
+            sys.exit(1)
+
+    def check_warm_start(self):
+        """
+        Warns once if warm_start is enabled for a solver which does not accept
+        a starting point, the homes then solve without it.
+        :return: None
+        """
+        hems = self.config['home']['hems']
+        if hems.get('warm_start', False) and hems['solver'] not in MPCCalc.warm_start_solvers:
+            self.log.logger.warning(f"warm_start is ignored for the solver {hems['solver']}, it is only used with: {', '.join(MPCCalc.warm_start_solvers)}.")
+
+    def check_parametrized(self):
+        """
+        Warns if parametrized problems are used where the homes are sent to
+        new worker processes every timestep (pool engine with the process
+        executor): the copies are never solved before, so each timestep
+        compiles the problem again and the parameters save nothing.
+        :return: None
+        """
+        hems = self.config['home']['hems']
+        if hems.get('parametrized', False) and self.engine == 'pool' and self.config['simulation'].get('executor', 'process') == 'process':
+            self.log.logger.warning("parametrized problems are rebuilt every timestep by the process executor of the pool engine, use the batch or actors engine (or the thread executor) to reuse them.")
+
     def _set_dt(self):
         """
         Convert the start and end datetimes specified in the config file into python datetime
@@ -137,24 +200,18 @@ class Aggregator:
             self.log.logger.error(f"Timeseries data file does not exist: {self.ts_data_file}")
             sys.exit(1)
 
-        df = pd.read_csv(self.ts_data_file, skiprows=2)
         self.dt = int(self.config['agg']['subhourly_steps'])
         self.dt_interval = 60 // self.dt
-        reps = [np.ceil(self.dt/2) if val==0 else np.floor(self.dt/2) for val in df.Minute]
-        df = df.loc[np.repeat(df.index.values, reps)]
-        interval_minutes = self.dt_interval * np.arange(self.dt)
-        n_intervals = len(df.index) // self.dt
-        x = np.tile(interval_minutes, n_intervals)
-        df.Minute = x
-        df = df.astype(str)
-        df['ts'] = df[["Year", "Month", "Day", "Hour", "Minute"]].apply(lambda x: ' '.join(x), axis=1)
-        df = df.rename(columns={"Temperature": "OAT"})
-        df["ts"] = df["ts"].apply(lambda x: datetime.strptime(x, '%Y %m %d %H %M'))
-        df = df.filter(["ts", "GHI", "OAT"])
-        df[["GHI", "OAT"]] = df[["GHI", "OAT"]].astype(int)
+        cache_file = self._ts_cache_file() if self.config['simulation'].get('ts_cache', True) else None
+        if cache_file is not None and os.path.isfile(cache_file):
+            with np.load(cache_file) as data:
+                df = pd.DataFrame({"GHI": data["GHI"], "OAT": data["OAT"]}, index=pd.DatetimeIndex(data["ts"], name="ts"))
+        else:
+            df = self._read_ts_csv()
+            if cache_file is not None:
+                self._write_ts_cache(cache_file, df)
         self.oat = df['OAT'].to_numpy()
         self.ghi = df['GHI'].to_numpy()
-        df = df.set_index('ts')
 
         day_of_year = 0
         self.thermal_trend = self.oat[4 * self.dt] - self.oat[0]
@@ -164,6 +221,52 @@ class Aggregator:
 
         return df
 
+    def _read_ts_csv(self):
+        """
+        Reads the NSRDB file and repeats its half-hourly values for the
+        subhourly_steps of the simulation (the value at minute 0 for the first
+        half of the hour, the value at minute 30 for the second half).
+        :return: pandas.DataFrame, index: ts, columns: GHI, OAT
+        """
+        df = pd.read_csv(self.ts_data_file, skiprows=2, usecols=["Year", "Month", "Day", "Hour", "Minute", "GHI", "Temperature"])
+        reps = np.where(df.Minute.to_numpy() == 0, np.ceil(self.dt / 2), np.floor(self.dt / 2)).astype(int)
+        df = df.loc[np.repeat(df.index.values, reps)]
+        n_intervals = len(df.index) // self.dt
+        df["Minute"] = np.tile(self.dt_interval * np.arange(self.dt), n_intervals)
+        ts = pd.to_datetime(df[["Year", "Month", "Day", "Hour", "Minute"]].rename(columns=str.lower))
+        return pd.DataFrame({"GHI": df["GHI"].to_numpy().astype(int), "OAT": df["Temperature"].to_numpy().astype(int)}, index=pd.DatetimeIndex(ts, name="ts"))
+
+    def _ts_cache_file(self):
+        """
+        Cache of the timeseries data processed by _read_ts_csv, keyed by the
+        content hash of the NSRDB file and the subhourly_steps, in the cache
+        directory (ts_cache_dir, by default in the outputs directory, so that the
+        data directory may be read-only or shared).
+        :return: str
+        """
+        digest = hashlib.sha256()
+        with open(self.ts_data_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        name = os.path.splitext(os.path.basename(self.ts_data_file))[0]
+        cache_dir = os.path.expanduser(self.config['simulation'].get('ts_cache_dir', os.path.join(self.outputs_dir, "cache")))
+        return os.path.join(cache_dir, f"{name}-{digest.hexdigest()[:16]}-{self.dt}.npz")
+
+    def _write_ts_cache(self, cache_file, df):
+        """
+        Writes the processed timeseries data to the cache (binary npz), so that
+        later runs skip parsing the NSRDB file.
+        :return: None
+        """
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp = f"{cache_file}.tmp"
+            with open(tmp, 'wb') as f:
+                np.savez(f, ts=df.index.values.astype("datetime64[ns]"), GHI=df["GHI"].to_numpy(), OAT=df["OAT"].to_numpy())
+            os.replace(tmp, cache_file)
+        except OSError as e:
+            self.log.logger.warning(f"Unable to write the timeseries cache {cache_file}: {e}")
+
     def _import_spp_data(self):
         """
         Settlement Point Price (SPP) data as extracted from ERCOT historical DAM Load Zone and Hub Prices.
@@ -383,7 +486,17 @@ class Aggregator:
             "hourly_agg_steps": self.dt,
             "sub_subhourly_steps": self.config['home']['hems']['sub_subhourly_steps'],
             "solver": self.config['home']['hems']['solver'],
-            "discount_factor": self.config['home']['hems']['discount_factor']
+            "discount_factor": self.config['home']['hems']['discount_factor'],
+            "parametrized": self.config['home']['hems'].get('parametrized', False),
+            "warm_start": self.config['home']['hems'].get('warm_start', False),
+            "fallback_solvers": self.config['home']['hems'].get('fallback_solvers', []),
+            "time_limit": self.config['home']['hems'].get('time_limit', 0),
+            "mip_gap": self.config['home']['hems'].get('mip_gap', 0),
+            "mode": self.config['home']['hems'].get('mode', 'mpc'),
+            "relaxed_gap_sample": self.config['home']['hems'].get('relaxed_gap_sample', 0),
+            "dp_grid_points": self.config['home']['hems'].get('dp_grid_points', 21),
+            "dp_penalty": self.config['home']['hems'].get('dp_penalty', 1e4),
+            "plan_encoding": self.config['home']['hems'].get('plan_encoding', 'text')
         }
 
         if not os.path.isdir(os.path.join('home_logs')):
@@ -581,38 +694,44 @@ class Aggregator:
         self.all_homes_obj = []
         self.max_poss_load = 0
         self.min_poss_load = 0
-        for home in all_homes:
-            home_obj = MPCCalc(home)
+        # independent, reproducible forecast errors for each home
+        noise_seeds = np.random.SeedSequence(self.config['simulation']['random_seed']).spawn(len(all_homes))
+        for home, noise_seed in zip(all_homes, noise_seeds):
+            home_obj = MPCCalc(home, noise_seed)
             self.all_homes_obj += [home_obj]
             self.max_poss_load += home_obj.max_load
 
     def reset_collected_data(self):
         self.timestep = 0
         self.baseline_agg_load_list = []
+        self.redis_round_trips = []
+        self.late_homes = []
+        self.set_collect_fields()
+        homes = []
         for home in self.all_homes:
-            self.collected_data[home["name"]] = {
-                "type": home["type"],
-                "temp_in_sp": home["hvac"]["temp_in_sp"],
-                "temp_wh_sp": home["wh"]["temp_wh_sp"],
-                "temp_in_opt": [home["hvac"]["temp_in_init"]],
-                "temp_wh_opt": [home["wh"]["temp_wh_init"]],
-                "p_grid_opt": [],
-                "forecast_p_grid_opt": [],
-                "p_load_opt": [],
-                "hvac_cool_on_opt": [],
-                "hvac_heat_on_opt": [],
-                "wh_heat_on_opt": [],
-                "cost_opt": [],
-                "waterdraws": [],
-                "correct_solve": []
-            }
+            keys = ["temp_in_opt", "temp_wh_opt", "p_grid_opt", "forecast_p_grid_opt", "p_load_opt", "hvac_cool_on_opt", "hvac_heat_on_opt", "wh_heat_on_opt", "cost_opt", "waterdraws", "correct_solve", "solve_tier"]
+            initial = {"temp_in_opt": home["hvac"]["temp_in_init"], "temp_wh_opt": home["wh"]["temp_wh_init"]}
             if 'pv' in home["type"]:
-                self.collected_data[home["name"]]["p_pv_opt"] = []
-                self.collected_data[home["name"]]["u_pv_curt_opt"] = []
+                keys += ["p_pv_opt", "u_pv_curt_opt"]
             if 'battery' in home["type"]:
-                self.collected_data[home["name"]]["e_batt_opt"] = [home["battery"]["e_batt_init"]]
-                self.collected_data[home["name"]]["p_batt_ch"] = []
-                self.collected_data[home["name"]]["p_batt_disch"] = []
+                keys += ["e_batt_opt", "p_batt_ch", "p_batt_disch"]
+                initial["e_batt_opt"] = home["battery"]["e_batt_init"]
+            if home["hems"].get("mode", "mpc") == "relaxed":
+                keys += ["relaxed_gap"]
+            if self.deadline > 0:
+                keys += ["late"]
+            homes.append({
+                "name": home["name"],
+                "meta": {
+                    "type": home["type"],
+                    "temp_in_sp": home["hvac"]["temp_in_sp"],
+                    "temp_wh_sp": home["wh"]["temp_wh_sp"]
+                },
+                "keys": keys,
+                "initial": initial
+            })
+        self.collected_data = ResultStore(self.collect_fields, homes, self.num_timesteps, state_fields=["temp_in_opt", "temp_wh_opt", "e_batt_opt"])
+        self.collect_rows = np.array([self.collected_data.home_index[name] for name in self.collect_homes], dtype=int)
 
     def check_all_data_indices(self):
         """
@@ -644,35 +763,61 @@ class Aggregator:
         """
         self.timestep = 0
 
-        self.redis_client.conn.set("start_hour_index", self.start_hour_index)
-        self.redis_client.conn.hset("current_values", "timestep", self.timestep)
+        self.redis_client.conn.set(self.redis_client.key("start_hour_index"), self.start_hour_index)
+        self.redis_client.conn.hset(self.redis_client.key("current_values"), "timestep", self.timestep)
 
         self.reward_price = np.zeros(self.config['agg']['rl']['action_horizon'] * self.dt)
-        self.redis_client.conn.rpush("reward_price", *self.reward_price.tolist())
+        self.redis_client.conn.rpush(self.redis_client.key("reward_price"), *self.reward_price.tolist())
 
     def redis_add_all_data(self):
         """
         Values for the timeseries data are written to Redis as a list, where the
         column names: [GHI, OAT, SPP] are the redis keys.  Each list is as long
         as the data in self.all_data, which is 8760 for default config file.
+        With env_data = "shared" the data is instead published once as a
+        read-only memory mapped array (see publish_environmental_data).
         :return: None
         """
+        if self.env_data == 'shared':
+            self.publish_environmental_data()
+            return
         for c in self.all_data.columns.to_list():
-            self.redis_client.conn.delete(c)
-            self.redis_client.conn.rpush(c, *self.all_data[c].values.tolist())
+            self.redis_client.conn.delete(self.redis_client.key(c))
+            self.redis_client.conn.rpush(self.redis_client.key(c), *self.all_data[c].values.tolist())
+
+    def publish_environmental_data(self):
+        """
+        Writes self.all_data once to a shared memory mapped file and stores its
+        descriptor in the Redis hash "env_data", so that the homes of all
+        workers attach to the same read-only copy of the data.
+        :return: None
+        """
+        self.env_desc = publish_data(self.all_data, f"dragg-env-{self.run_id}")
+        self.redis_client.conn.hset(self.redis_client.key("env_data"), mapping=self.env_desc)
+
+    def release_environmental_data(self):
+        """
+        Removes the shared environmental data at the end of the run.
+        :return: None
+        """
+        if self.env_desc is not None:
+            release_data(self.env_desc)
+            self.env_desc = None
 
     def redis_set_current_values(self):
         """
         Sets the current values of the utility agent (reward price).
         :return: None
         """
-        self.redis_client.conn.hset("current_values", "timestep", self.timestep)
+        pipe = self.redis_client.conn.pipeline()
+        pipe.hset(self.redis_client.key("current_values"), "timestep", self.timestep)
 
         if 'rl' in self.case:
             self.all_sps[self.timestep] = self.agg_setpoint
             self.all_rps[self.timestep] = self.reward_price[0]
-            self.redis_client.conn.delete("reward_price")
-            self.redis_client.conn.rpush("reward_price", *self.reward_price)
+            pipe.delete(self.redis_client.key("reward_price"))
+            pipe.rpush(self.redis_client.key("reward_price"), *self.reward_price)
+        pipe.execute()
 
     def gen_setpoint(self):
         """
@@ -720,62 +865,230 @@ class Aggregator:
         self.min_daily_temp = min(self.oat[day_of_year*(self.dt*24):(day_of_year+1)*(self.dt*24)])
         self.max_daily_ghi = max(self.ghi[day_of_year*(self.dt*24):(day_of_year+1)*(self.dt*24)])
 
-        pool = ProcessPool(nodes=self.config['simulation']['n_nodes']) # open a pool of nodes
-        results = pool.map(manage_home, self.as_list)
+        if self.engine == 'batch':
+            for batch in self.batches:
+                manage_batch(batch)
+        elif self.engine == 'actors':
+            self.iteration_results = self.actors.step(self.timestep, self.reward_price)
+        else:
+            if self.executor is None:
+                self.set_executor()
+            if self.deadline > 0 and self.executor.backend == 'process':
+                self.run_deadline_iteration()
+            else:
+                results = self.executor.map(manage_home, self.as_list)
 
         self.timestep += 1
 
+    def run_deadline_iteration(self):
+        """
+        Solves all homes on the executor but waits at most deadline seconds for
+        them. Homes which miss the deadline get the rule-based fallback
+        (MPCCalc.run_late_fallback) and are flagged as late; their solves are
+        skipped if not yet started, or finish in the background with their
+        results discarded. A home which claimed its results just before the
+        fallback (see MPCCalc.redis_write_optimal_vals) is waited for, so that
+        its values and totals are written before they are collected.
+        :return: None
+        """
+        start = time.perf_counter()
+        reward_price = [float(rp) for rp in self.reward_price]
+        results = [self.executor.submit(manage_home_at, (home, self.timestep, reward_price)) for home in self.as_list]
+        for r in results:
+            r.wait(max(0, start + self.deadline - time.perf_counter()))
+
+        late = []
+        running = []
+        for home, r in zip(self.as_list, results):
+            if r.ready():
+                r.get() # raises the exception of the home, if any
+            elif home.run_late_fallback(self.timestep, reward_price):
+                late.append(home.name)
+                running.append(r)
+            else: # the home claimed its results just before the fallback, wait for them to be written
+                r.get()
+        self.late_homes.append(len(late))
+        if late:
+            self.log.logger.warning(f"{len(late)} homes missed the deadline of timestep {self.timestep}: {late}")
+        self.pending_claims.append((self.timestep, running))
+        self.prune_claims()
+
+    def prune_claims(self):
+        """
+        Deletes the claims hash (MPCCalc.claims_key) of the timesteps whose
+        solves have all finished. The hash is kept while a late home may still
+        finish, so that it finds the claim of the fallback and discards its
+        results.
+        :return: None
+        """
+        pending = []
+        for timestep, running in self.pending_claims:
+            if all(r.ready() for r in running):
+                self.redis_client.conn.delete(self.redis_client.key(f"claims:{timestep}"))
+            else:
+                pending.append((timestep, running))
+        self.pending_claims = pending
+
+    def set_batches(self):
+        """
+        Groups the homes in as_list into batches of batch_size homes (all homes
+        in one batch if not set) whose MPC problems are stacked into a single
+        block-diagonal problem and solved once per timestep.
+        :return: None
+        """
+        batch_size = int(self.config['simulation'].get('batch_size', 0)) or len(self.as_list)
+        self.batches = [MPCBatch(self.as_list[i:i + batch_size]) for i in range(0, len(self.as_list), batch_size)]
+
+    def set_executor(self):
+        """
+        Creates the pool of workers (executor, n_nodes, chunk_size in the config)
+        which solves the homes of the 'pool' engine every timestep of the run.
+        :return: None
+        """
+        self.executor = Executor.from_config(self.config)
+        if self.deadline > 0 and self.executor.backend != 'process':
+            self.log.logger.warning("The deadline requires the process executor (late homes keep running on their objects in threads), waiting for all homes.")
+
+    def close_engine(self):
+        """
+        Stops the worker processes (or threads) of the engine at the end of the run.
+        :return: None
+        """
+        if self.actors is not None:
+            self.actors.close()
+            self.actors = None
+        if self.executor is not None:
+            self.executor.close()
+            self.executor = None
+
+    def set_actors(self):
+        """
+        Starts n_nodes long-lived worker processes which own a fixed shard of
+        the homes in as_list for the whole run. Every timestep they reply with
+        the collect_fields of their homes, so that collect_home_data does not
+        read them back from redis.
+        :return: None
+        """
+        self.actors = HomeActors(self.as_list, self.config['simulation']['n_nodes'], self.collect_fields)
+        index = {name: i for i, name in enumerate(self.collect_homes)}
+        self.actor_rows = np.array([index[home.name] for home in self.as_list], dtype=int)  # rows of collected_vals of the replies
+
+    def set_collect_fields(self):
+        """
+        Sets the homes and fields read by collect_data and preallocates the
+        array (homes x fields) the values of each timestep are decoded into.
+        :return: None
+        """
+        homes = [home for home in self.all_homes if self.check_type == 'all' or home["type"] == self.check_type]
+        base_keys = ["p_grid_opt", "forecast_p_grid_opt", "p_load_opt", "temp_in_opt", "temp_wh_opt", "hvac_cool_on_opt", "hvac_heat_on_opt", "wh_heat_on_opt", "cost_opt", "waterdraws", "correct_solve", "solve_tier"]
+        pv_keys = ['p_pv_opt', 'u_pv_curt_opt']
+        battery_keys = ['p_batt_ch', 'p_batt_disch', 'e_batt_opt']
+        self.collect_homes = [home["name"] for home in homes]
+        self.collect_fields = base_keys + pv_keys + battery_keys + ['relaxed_gap', 'late', 'round_trips']
+        self.collect_index = {k: j for j, k in enumerate(self.collect_fields)}
+        self.collected_vals = np.full((len(homes), len(self.collect_fields)), np.nan)
+
+    def collect_totals(self):
+        """
+        Reads the community totals of the last timestep, accumulated on the
+        redis server by the homes as they finish (MPCCalc.total_keys), in one
+        round-trip independent of the number of homes.
+        :return: None
+        """
+        totals = self.redis_client.read_totals(self.redis_client.key(f"totals:{self.timestep - 1}"))
+        if int(totals.get("homes", 0)) != len(self.collect_homes):
+            self.log.logger.warning(f"Totals of timestep {self.timestep - 1} include {int(totals.get('homes', 0))} of {len(self.collect_homes)} homes.")
+        self.agg_load = totals.get("p_grid_opt", 0.0)
+        self.forecast_load = totals.get("forecast_p_grid_opt", 0.0)
+        self.agg_cost = totals.get("cost_opt", 0.0)
+        self.homes_round_trips = int(totals.get("round_trips", 0))
+
+    def collect_home_data(self):
+        """
+        Collects the data passed by the community redis connection. The current
+        values of all homes are fetched in one pipelined request (or taken from
+        the replies of the actors), decoded into collected_vals (homes x
+        collect_fields) and appended to collected_data.
+        :return: None
+        """
+        if self.iteration_results is not None:
+            self.collected_vals[self.actor_rows] = self.iteration_results
+            self.iteration_results = None
+        else:
+            pipe = self.redis_client.conn.pipeline(transaction=False)
+            for name in self.collect_homes:
+                pipe.hmget(self.redis_client.key(name), self.collect_fields)
+            for i, row in enumerate(pipe.execute()):
+                self.collected_vals[i] = [v if v is not None else np.nan for v in row]
+
+        self.collected_data.append(self.collect_rows, self.collected_vals)
+
     def collect_data(self):
         """
-        Collects the data passed by the community redis connection.
+        Collects the community totals of the last timestep and (unless
+        collect_home_data is disabled) the values of each home.
         :return: None
         """
-        agg_load = 0
-        agg_cost = 0
-        self.house_load = []
-        self.forecast_house_load = []
-        for home in self.all_homes:
-            if self.check_type == 'all' or home["type"] == self.check_type:
-                vals = self.redis_client.conn.hgetall(home["name"])
-                for k, v in vals.items():
-                    opt_keys = ["p_grid_opt", "forecast_p_grid_opt", "p_load_opt", "temp_in_opt", "temp_wh_opt", "hvac_cool_on_opt", "hvac_heat_on_opt", "wh_heat_on_opt", "cost_opt", "waterdraws", "correct_solve"]
-                    if 'pv' in home["type"]:
-                        opt_keys += ['p_pv_opt','u_pv_curt_opt']
-                    if 'battery' in home["type"]:
-                        opt_keys += ['p_batt_ch', 'p_batt_disch', 'e_batt_opt']
-                    if k in opt_keys:
-                        self.collected_data[home["name"]][k].append(float(v))
-                self.house_load.append(float(vals["p_grid_opt"]))
-                self.forecast_house_load.append(float(vals["forecast_p_grid_opt"]))
-                agg_cost += float(vals["cost_opt"])
-        self.agg_load = np.sum(self.house_load)
-        self.forecast_load = np.sum(self.forecast_house_load)
-        self.agg_cost = agg_cost
+        self.collect_totals()
+        if self.collect_home_data_enabled:
+            self.collect_home_data()
         self.baseline_agg_load_list.append(self.agg_load)
         self.agg_setpoint = self.gen_setpoint()
 
-    def run_baseline(self):
+    def run_baseline(self, resumed=False):
         """
         Runs the baseline simulation comprised of community of HEMS controlled homes.
         Utilizes MPC parameters specified in config file.
         (For no MPC in HEMS specify the MPC prediction horizon as 0.)
+        params
+        resumed: bool, the run continues from the timestep restored by resume_from_checkpoint
         :return: None
         """
         self.log.logger.info(f"Performing baseline run for horizon: {self.config['home']['hems']['prediction_horizon']}")
-        self.start_time = datetime.now()
+        self.start_time = datetime.now() - timedelta(seconds=self.resumed_time)
 
         self.as_list = []
         for home in self.all_homes_obj:
             if self.check_type == "all" or home.type == self.check_type:
                 self.as_list += [home]
-        for t in range(self.num_timesteps):
-            self.redis_set_current_values()
-            self.run_iteration()
-            self.collect_data()
+        if self.engine == 'batch':
+            self.set_batches()
+        elif self.engine == 'actors':
+            self.set_actors()
+        else:
+            self.set_executor()
+        self.set_checkpoints(resumed)
 
-            if (t+1) % (self.checkpoint_interval) == 0: # weekly checkpoint
-                self.log.logger.info("Creating a checkpoint file.")
-                self.write_outputs()
+        self.last_round_trips = self.redis_client.round_trips
+        try:
+            for t in range(self.timestep, self.num_timesteps):
+                self.redis_set_current_values()
+                self.run_iteration()
+                self.collect_data()
+                self.count_round_trips()
+
+                if (t+1) % (self.checkpoint_interval) == 0: # weekly checkpoint
+                    self.log.logger.info("Creating a checkpoint file.")
+                    self.write_checkpoint()
+        finally:
+            self.close_engine()
+            self.close_checkpoints()
+
+    def count_round_trips(self):
+        """
+        Records the round-trips to redis of the timestep: those reported by the
+        homes plus those of the aggregator (setting the current values and
+        collecting the results).
+        :return: None
+        """
+        agg_round_trips = self.redis_client.round_trips - self.last_round_trips
+        if self.engine == 'batch' or self.executor is not None and self.executor.backend == 'thread':
+            # homes run in the aggregator process and are counted by the aggregator
+            self.redis_round_trips.append(agg_round_trips)
+        else:
+            self.redis_round_trips.append(agg_round_trips + self.homes_round_trips)
+        self.last_round_trips = self.redis_client.round_trips
+        self.log.logger.debug(f"Redis round-trips in timestep {self.timestep - 1}: {self.redis_round_trips[-1]}")
 
     def my_summary(self):
         return
@@ -805,9 +1118,19 @@ class Aggregator:
             "GHI": self.all_data.loc[self.mask, "GHI"].values.tolist(),
             "RP": self.all_rps.tolist(),
             "p_grid_setpoint": self.all_sps.tolist(),
+            "redis_round_trips": self.redis_round_trips,
+            "redis_stats": self.redis_client.stats(),
+            "solver_tiers": ([] if self.config['home']['hems'].get('mode', 'mpc') == 'rule_based' else [self.config['home']['hems']['solver']] + self.config['home']['hems'].get('fallback_solvers', [])) + ["rule_based"],
             # "rl_rewards": self.all_rewards
         }
 
+        if self.config['home']['hems'].get('mode', 'mpc') == 'relaxed':
+            gaps = self.collected_data.field("relaxed_gap")
+            self.collected_data["Summary"]["relaxed_gap"] = np.nanmean(gaps) if np.any(~np.isnan(gaps)) else None
+
+        if self.deadline > 0:
+            self.collected_data["Summary"]["late_homes"] = self.late_homes
+
         self.my_summary()
 
         if self.config['agg']['spp_enabled']:
@@ -828,20 +1151,165 @@ class Aggregator:
         if not os.path.isdir(self.run_dir):
             os.makedirs(self.run_dir)
 
+    def checkpoint_dir(self):
+        """
+        :return: str, directory of the checkpoints of the case
+        """
+        return os.path.join(self.run_dir, self.case, "checkpoints")
+
+    def set_checkpoints(self, resumed=False):
+        """
+        Starts the checkpoints of the case in the run directory (removing the
+        checkpoints of an earlier run of the case), or continues them if the run
+        was resumed.
+        :return: None
+        """
+        self.checkpoints = CheckpointWriter(self.checkpoint_dir())
+        if resumed:
+            self.checkpoints.load()
+        else:
+            self.checkpoints.reset()
+        if self.checkpoint_queue > 0:
+            self.checkpoint_thread = CheckpointThread(self.checkpoints, self.checkpoint_queue)
+
+    def close_checkpoints(self):
+        """
+        Waits until the background writer has written the queued checkpoints and
+        stops it (later checkpoints are written directly).
+        :return: None
+        """
+        if self.checkpoint_thread is not None:
+            thread, self.checkpoint_thread = self.checkpoint_thread, None
+            thread.close()
+            if thread.error is not None:
+                self.log.logger.error(f"Writing a checkpoint failed: {thread.error}")
+            thread.check()
+
+    def plan_dtype(self):
+        """
+        :return: str, dtype of the packed plans of the homes (float64 for plans written as text fields)
+        """
+        encoding = self.config['home']['hems'].get('plan_encoding', 'text')
+        return "float64" if encoding == 'text' else encoding
+
+    def checkpoint_series(self):
+        """
+        Values of the community indexed by timestep which are written with the
+        checkpoints.
+        :return: dict
+        """
+        return {
+            "p_grid_aggregate": self.baseline_agg_load_list,
+            "redis_round_trips": self.redis_round_trips,
+            "late_homes": self.late_homes,
+            "RP": self.all_rps,
+            "p_grid_setpoint": self.all_sps
+        }
+
+    def write_checkpoint(self):
+        """
+        Appends the values of the timesteps since the last checkpoint to the
+        checkpoints (see CheckpointWriter, load_checkpoints). With the background
+        writer only a snapshot is taken here; an error of an earlier checkpoint
+        is raised.
+        :return: None
+        """
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.submit(self.collected_data, self.timestep, self.checkpoint_series(), self.checkpoint_state())
+            return
+        self.checkpoints.write(self.collected_data, self.timestep, self.checkpoint_series())
+        self.checkpoints.write_state(self.checkpoint_state()())
+
+    checkpoint_keys = ["reward_price", "agg_load", "agg_setpoint", "agg_cost", "avg_load", "tracked_loads", "max_load", "min_load",
+        "forecast_load", "prev_forecast_load"]
+
+    def checkpoint_state(self):
+        """
+        State of the simulation at the current timestep from which the run can
+        be resumed: the values of the utility (see checkpoint_keys), the hashes
+        of the homes in redis (with the initial conditions, solve counters and
+        plans of their next timestep) and the state of the RL agent, if any.
+        Only cheap copies are made here: the hashes of the homes are copied on
+        the redis server (see RedisClient.snapshot_hashes) and read by the
+        returned function, which may be called by the background writer while
+        the simulation continues.
+        :return: function returning the state as a dict
+        """
+        names = [home["name"] for home in self.all_homes]
+        snapshots = self.redis_client.snapshot_hashes([self.redis_client.key(name) for name in names])
+        agent = getattr(self, "agent", None)
+        state = {
+            "timestep": self.timestep,
+            "run_time": (datetime.now() - self.start_time).total_seconds(),
+            "aggregator": {k: copy(getattr(self, k)) for k in self.checkpoint_keys if hasattr(self, k)},
+            "agent": agent.checkpoint_state() if agent is not None else None
+        }
+        dtype = self.plan_dtype()
+        def read_state():
+            state["homes"] = dict(zip(names, self.redis_client.dump_hashes(snapshots, dtype, delete=True)))
+            return state
+        return read_state
+
+    def resume_from_checkpoint(self):
+        """
+        Restores the simulation from the state of the last checkpoint of the
+        case (see checkpoint_state) together with the values collected up to it,
+        so that the run continues from that timestep with the same results.
+        :return: bool, False if there is no (matching) checkpoint and the run starts from the first timestep
+        """
+        checkpoints = load_checkpoints(self.checkpoint_dir())
+        state = load_state(self.checkpoint_dir())
+        if checkpoints is None or state is None:
+            self.log.logger.info("No checkpoint to resume from, starting from the first timestep.")
+            return False
+        store, series, manifest = checkpoints
+        t = state["timestep"]
+        end = manifest["chunks"][-1]["end"] if manifest["chunks"] else 0
+        if store.names != self.collected_data.names or store.fields != self.collected_data.fields or store.n_timesteps != self.num_timesteps or end != t:
+            self.log.logger.warning("The checkpoint does not match the configuration of the run, starting from the first timestep.")
+            return False
+
+        self.collected_data = store
+        self.baseline_agg_load_list = series.get("p_grid_aggregate", np.zeros(0)).tolist()
+        self.redis_round_trips = series.get("redis_round_trips", np.zeros(0)).astype(int).tolist()
+        self.late_homes = series.get("late_homes", np.zeros(0)).astype(int).tolist()
+        self.all_rps[:t] = series.get("RP", np.zeros(t))
+        self.all_sps[:t] = series.get("p_grid_setpoint", np.zeros(t))
+
+        names = list(state["homes"])
+        self.redis_client.restore_hashes([self.redis_client.key(name) for name in names], [state["homes"][name] for name in names], self.plan_dtype())
+        for k, v in state["aggregator"].items():
+            setattr(self, k, v)
+        self.reward_price = np.array(self.reward_price)
+        agent = getattr(self, "agent", None)
+        if agent is not None and state["agent"] is not None:
+            agent.restore_state(state["agent"])
+        self.timestep = t
+        self.resumed_time = state["run_time"]
+        self.log.logger.info(f"Resuming the run from the checkpoint at timestep {t}.")
+        return True
+
     def write_outputs(self):
         """
-        Writes values for simulation run to a json file for later reference. Is
-        called at the end of the simulation run period and optionally at a checkpoint period.
+        Writes the last checkpoint and the summary of the simulation run, and
+        exports all values to a json file (results.json) for later reference
+        unless export_json is disabled. Is called at the end of the simulation run period.
         :return: None
         """
+        self.write_checkpoint()
         self.summarize_baseline()
 
         case_dir = os.path.join(self.run_dir, self.case)
         if not os.path.isdir(case_dir):
             os.makedirs(case_dir)
-        file = os.path.join(case_dir, "results.json")
-        with open(file, 'w+') as f:
-            json.dump(self.collected_data, f, indent=4)
+        if self.config['simulation'].get('export_json', True):
+            file = os.path.join(case_dir, "results.json")
+            with open(file, 'w+') as f:
+                json.dump(self.collected_data.to_dict(), f, indent=4)
+        else:
+            file = os.path.join(case_dir, "summary.json")
+            with open(file, 'w+') as f:
+                json.dump(self.collected_data["Summary"], f, indent=4)
 
     def write_home_configs(self):
         """
@@ -912,13 +1380,14 @@ class Aggregator:
 
     def flush_redis(self):
         """
-        Cleans all information stored in the Redis server. (Including environmental
-        and home data.)
+        Cleans all information of the run stored in the Redis server. (Including
+        environmental and home data.) Keys of other runs are not touched.
         :return: None
         """
-        self.redis_client.conn.flushall()
+        self.redis_client.delete_run_keys()
         self.log.logger.info("Flushing Redis")
-        time.sleep(1)
+        if self.transport == 'redis':
+            time.sleep(1)
         self.check_all_data_indices()
         self.calc_start_hour_index()
         self.redis_add_all_data()
@@ -964,7 +1433,12 @@ class Aggregator:
             # for self.mpc in self.mpc_permutations:
             # for self.version in self.versions:
             self.flush_redis()
-            self.get_homes()
-            self.reset_collected_data()
-            self.run_baseline()
-            self.write_outputs()
+            try:
+                self.get_homes()
+                self.reset_collected_data()
+                resumed = self.resume and self.resume_from_checkpoint()
+                self.run_baseline(resumed)
+                self.write_outputs()
+            finally:
+                self.release_environmental_data()
+                self.redis_client.delete_run_keys()
@@ -0,0 +1,65 @@
+import time
+
+from dragg.aggregator import Aggregator
+from dragg.logger import Logger
+
+def setup_community(n_homes, engine):
+    """
+    Sets up an aggregator with a community of n_homes, keeping the proportion of
+    pv and battery homes from the config file.
+    :return: Aggregator
+    """
+    agg = Aggregator()
+    total = agg.config['community']['total_number_homes']
+    for k in ['homes_battery', 'homes_pv', 'homes_pv_battery']:
+        agg.config['community'][k] = agg.config['community'][k] * n_homes // total
+    agg.config['community']['total_number_homes'] = n_homes
+    agg.engine = engine
+    agg.check_transport()
+
+    agg.flush_redis()
+    agg.get_homes()
+    agg.reset_collected_data()
+    agg.as_list = [home for home in agg.all_homes_obj if agg.check_type == "all" or home.type == agg.check_type]
+    if agg.engine == 'batch':
+        agg.set_batches()
+    elif agg.engine == 'actors':
+        agg.set_actors()
+    else:
+        agg.set_executor()
+    return agg
+
+def benchmark_engine(n_homes, engine, n_timesteps):
+    """
+    Times the MPC solves (run_iteration) of the community for n_timesteps.
+    :return: float, homes per second
+    """
+    agg = setup_community(n_homes, engine)
+    elapsed = 0
+    for t in range(n_timesteps):
+        agg.redis_set_current_values()
+        start = time.perf_counter()
+        agg.run_iteration()
+        elapsed += time.perf_counter() - start
+        agg.collect_data()
+    agg.close_engine()
+    agg.release_environmental_data()
+    return len(agg.as_list) * n_timesteps / elapsed
+
+def run_benchmarks(n_homes_list=[10, 100, 1000], engines=['pool', 'batch', 'actors'], n_timesteps=3):
+    """
+    Compares the homes solved per second of each engine for communities of
+    increasing size. Requires a running redis server and the usual config file.
+    :return: dict, homes per second by engine and number of homes
+    """
+    log = Logger("benchmark")
+    results = {}
+    for engine in engines:
+        results[engine] = {}
+        for n_homes in n_homes_list:
+            results[engine][n_homes] = benchmark_engine(n_homes, engine, n_timesteps)
+            log.logger.info(f"Engine: {engine}; Homes: {n_homes}; Homes per second: {results[engine][n_homes]:.1f}")
+    return results
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,228 @@
+import os
+import glob
+import json
+import threading
+from queue import Queue
+import numpy as np
+
+from dragg.result_store import ResultStore
+
+MANIFEST = "manifest.json"
+STATE = "state.json"
+
+def write_json(path, data):
+    """
+    Writes data as json atomically (readers see the previous or the new file, never a partial one).
+    :return: None
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, default=lambda x: x.tolist() if isinstance(x, np.ndarray) else float(x))
+    os.replace(tmp, path)
+
+class CheckpointWriter:
+    def __init__(self, path):
+        """
+        Append-only checkpoints of a ResultStore: every checkpoint writes only
+        the timesteps since the last one as a compressed .npz chunk and adds it
+        to the manifest (json) which describes the fields, homes and chunks.
+        params
+        path: str, directory of the chunks and the manifest
+        """
+        self.path = path
+        self.manifest = None
+        self.snapshot_end = 0 # timestep up to which (excluding) snapshots have been taken, see snapshot
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def reset(self):
+        """
+        Removes the chunks, the manifest and the state of an earlier run.
+        :return: None
+        """
+        for file in glob.glob(os.path.join(self.path, "chunk-*.npz")) + [os.path.join(self.path, MANIFEST), os.path.join(self.path, STATE)]:
+            if os.path.isfile(file):
+                os.remove(file)
+        self.manifest = None
+        self.snapshot_end = 0
+
+    def load(self):
+        """
+        Continues the checkpoints written so far (e.g. of a resumed run), later
+        chunks are appended to them.
+        :return: None
+        """
+        file = os.path.join(self.path, MANIFEST)
+        self.manifest = None
+        if os.path.isfile(file):
+            with open(file) as f:
+                self.manifest = json.load(f)
+        self.snapshot_end = self.end
+
+    @property
+    def end(self):
+        """
+        Timestep up to which (excluding) the values have been written.
+        :return: int
+        """
+        if self.manifest is None or not self.manifest["chunks"]:
+            return 0
+        return self.manifest["chunks"][-1]["end"]
+
+    def write(self, store, t1, series={}):
+        """
+        Writes the timesteps of the store since the last checkpoint up to t1
+        (excluding) as one chunk.
+        params
+        store: ResultStore
+        t1: int, number of timesteps run so far
+        series: dict of lists or np.array indexed by timestep (e.g. the aggregate load), written for the same timesteps
+        :return: None
+        """
+        self.write_snapshot(self.snapshot(store, t1, series))
+
+    def snapshot(self, store, t1, series={}):
+        """
+        Copies the values of the chunk written by write (see write for the
+        params), so that the chunk can be written while the store is appended to.
+        :return: dict, the chunk passed to write_snapshot, or None if there are no new timesteps
+        """
+        if self.manifest is None:
+            self.manifest = {
+                "fields": store.fields,
+                "state_fields": store.state_fields,
+                "n_timesteps": store.n_timesteps,
+                "homes": store.homes,
+                "chunks": []
+            }
+        t0 = self.snapshot_end
+        if t1 <= t0:
+            return None
+        self.snapshot_end = t1
+        return {
+            "start": t0,
+            "end": t1,
+            "values": store.timestep_values(t0, t1),
+            "counts": store.counts.copy(),
+            "series": {f"series_{k}": np.array(v[t0:t1], dtype=float) for k, v in series.items() if len(v) >= t1}
+        }
+
+    def write_snapshot(self, chunk):
+        """
+        Writes a chunk taken by snapshot and adds it to the manifest.
+        :return: None
+        """
+        if chunk is None:
+            return
+        file = f"chunk-{len(self.manifest['chunks']):05d}.npz"
+        np.savez_compressed(os.path.join(self.path, file), values=chunk["values"], counts=chunk["counts"], **chunk["series"])
+        self.manifest["chunks"].append({"file": file, "start": chunk["start"], "end": chunk["end"]})
+        write_json(os.path.join(self.path, MANIFEST), self.manifest) # the manifest only lists complete chunks
+
+    def write_state(self, state):
+        """
+        Writes the state of the simulation at the last checkpoint (replacing
+        the previous state), from which a run can be resumed (see load_state).
+        params
+        state: dict, json serializable (np.array as lists)
+        :return: None
+        """
+        write_json(os.path.join(self.path, STATE), state)
+
+class CheckpointThread:
+    def __init__(self, writer, max_pending=2):
+        """
+        Writes the checkpoints of a CheckpointWriter in a background thread:
+        the caller only takes a snapshot of the values, which are compressed and
+        written while the simulation continues. At most max_pending checkpoints
+        wait to be written, submit blocks while the queue is full. An error of
+        the thread is raised by the next call to check (or submit).
+        params
+        writer: CheckpointWriter
+        max_pending: int, size of the queue of checkpoints
+        """
+        self.writer = writer
+        self.queue = Queue(maxsize=max(1, int(max_pending)))
+        self.error = None
+        self.thread = threading.Thread(target=self.work, name="checkpoints", daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None: # later chunks would leave a gap in the checkpoints
+                    chunk, state = item
+                    self.writer.write_snapshot(chunk)
+                    if state is not None:
+                        self.writer.write_state(state() if callable(state) else state)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """
+        Raises the error of the thread, if writing a checkpoint failed.
+        :return: None
+        """
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, store, t1, series={}, state=None):
+        """
+        Takes a snapshot of the values for CheckpointWriter.write and queues it
+        with the state for CheckpointWriter.write_state: a dict which must not be
+        changed by the caller afterwards, or a function returning it which is
+        called in the thread.
+        :return: None
+        """
+        self.check()
+        self.queue.put((self.writer.snapshot(store, t1, series), state))
+
+    def close(self):
+        """
+        Waits until the queued checkpoints are written and stops the thread.
+        :return: None
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+def load_checkpoints(path):
+    """
+    Joins the chunks written by CheckpointWriter.
+    params
+    path: str, directory of the chunks and the manifest
+    :return: tuple of the ResultStore, the series (dict of np.array) and the manifest, or None if there is no checkpoint
+    """
+    file = os.path.join(path, MANIFEST)
+    if not os.path.isfile(file):
+        return None
+    with open(file) as f:
+        manifest = json.load(f)
+    store = ResultStore(manifest["fields"], manifest["homes"], manifest["n_timesteps"], manifest["state_fields"])
+    series = {}
+    for chunk in manifest["chunks"]:
+        with np.load(os.path.join(path, chunk["file"])) as data:
+            store.set_timestep_values(chunk["start"], data["values"], data["counts"])
+            for k in data.files:
+                if k.startswith("series_"):
+                    series.setdefault(k[len("series_"):], []).append(data[k])
+    series = {k: np.concatenate(v) for k, v in series.items()}
+    return store, series, manifest
+
+def load_state(path):
+    """
+    Reads the state written by CheckpointWriter.write_state.
+    params
+    path: str, directory of the checkpoints
+    :return: dict, or None if there is no state
+    """
+    file = os.path.join(path, STATE)
+    if not os.path.isfile(file):
+        return None
+    with open(file) as f:
+        return json.load(f)
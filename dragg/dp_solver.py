@@ -0,0 +1,193 @@
+import numpy as np
+
+class DPSolver:
+    PENALTY = 1e4 # default cost per degree C outside of the temperature bounds
+
+    def __init__(self, homes, grid_points=21, penalty=PENALTY):
+        """
+        Solves the MPC problem of base homes (HVAC and water heater only) by
+        backward dynamic programming over discretized indoor air and water heater
+        temperatures, vectorized across homes. Uses the same dynamics and bounds
+        as MPCCalc.add_base_constraints.
+        params
+        homes: List of base MPCCalc homes with the initial conditions and environmental values of the current timestep
+        grid_points: int, number of temperature values between the lower and upper bound of each state
+        penalty: float, cost per degree C outside of the temperature bounds (soft constraint of the grid approximation)
+        """
+        self.homes = homes
+        self.horizon = homes[0].horizon
+        self.sub_subhourly_steps = homes[0].sub_subhourly_steps
+        self.discount = homes[0].discount
+        self.grid_points = max(2, int(grid_points))
+        self.penalty = float(penalty)
+        self.collect_parameters()
+
+    def collect_parameters(self):
+        """
+        Stacks the parameters, forecasts and bounds of all homes into arrays
+        with the homes along the first axis.
+        :return: None
+        """
+        def stack(f):
+            return np.array([f(home) for home in self.homes], dtype=float)
+
+        self.k_in = stack(lambda h: 3600 / (h.home_c.value * h.dt))
+        self.k_wh = stack(lambda h: 3600 / (h.wh_c.value * h.dt))
+        self.home_r = stack(lambda h: h.home_r.value)
+        self.wh_r = stack(lambda h: h.wh_r.value)
+        self.hvac_p_c = stack(lambda h: h.hvac_p_c.value)
+        self.hvac_p_h = stack(lambda h: h.hvac_p_h.value)
+        self.wh_p = stack(lambda h: h.wh_p.value)
+        self.tap_temp = stack(lambda h: h.tap_temp)
+        self.oat = stack(lambda h: np.asarray(h.oat_forecast.value, dtype=float))
+        self.rem = stack(lambda h: np.asarray(h.remainder_frac.value, dtype=float))
+        self.draw = stack(lambda h: np.asarray(h.draw_frac.value, dtype=float))
+        self.price = stack(lambda h: np.asarray(h.total_price.value, dtype=float))
+        self.temp_in_init = stack(lambda h: h.temp_in_init.value)
+        self.temp_wh_init = stack(lambda h: h.temp_wh_init.value)
+        self.temp_in_min = stack(lambda h: h.temp_in_min.value)
+        self.temp_in_max = stack(lambda h: h.temp_in_max.value)
+        self.temp_wh_min = stack(lambda h: h.temp_wh_min.value)
+        self.temp_wh_max = stack(lambda h: h.temp_wh_max.value)
+
+        # one HVAC duty cycle per step, cooling or heating depending on the season of each home
+        self.cooling = stack(lambda h: h.hvac_cool_max > 0)
+        self.heating = stack(lambda h: h.hvac_heat_max > 0)
+        self.hvac_actions = np.arange(self.sub_subhourly_steps + 1)
+        self.wh_actions = np.arange(self.sub_subhourly_steps + 1)
+
+        steps = np.linspace(0, 1, self.grid_points)
+        self.temp_in_grid = self.temp_in_min[:, None] + np.outer(self.temp_in_max - self.temp_in_min, steps)
+        self.temp_wh_grid = self.temp_wh_min[:, None] + np.outer(self.temp_wh_max - self.temp_wh_min, steps)
+
+    def expand(self, x):
+        """
+        Reshapes an array over homes to broadcast against
+        (homes, temp_in, temp_wh, hvac action, wh action).
+        :return: np.array
+        """
+        return x.reshape(-1, 1, 1, 1, 1)
+
+    def violation(self, x, lb, ub):
+        """
+        :return: np.array, distance of x outside of [lb, ub]
+        """
+        return np.maximum(np.maximum(lb - x, x - ub), 0)
+
+    def interpolate(self, value, temp_in, temp_wh):
+        """
+        Bilinear interpolation of the value function of each home on its
+        temperature grid, states outside of the grid take the value at the edge.
+        params
+        value: np.array (homes, grid_points, grid_points)
+        temp_in, temp_wh: np.array with the homes along the first axis
+        :return: np.array
+        """
+        g = self.grid_points
+        shape = np.broadcast(temp_in, temp_wh).shape
+        n = np.arange(len(self.homes)).reshape((-1,) + (1,) * (len(shape) - 1))
+        def index(x, grid):
+            lo = grid[:, 0].reshape(n.shape)
+            step = ((grid[:, -1] - grid[:, 0]) / (g - 1)).reshape(n.shape)
+            f = np.clip((x - lo) / np.where(step > 0, step, 1), 0, g - 1)
+            i = np.minimum(np.floor(f).astype(int), g - 2)
+            return np.broadcast_to(i, shape), np.broadcast_to(f - i, shape)
+        i, wi = index(temp_in, self.temp_in_grid)
+        j, wj = index(temp_wh, self.temp_wh_grid)
+        return ((1 - wi) * (1 - wj) * value[n, i, j] + wi * (1 - wj) * value[n, i + 1, j]
+                + (1 - wi) * wj * value[n, i, j + 1] + wi * wj * value[n, i + 1, j + 1])
+
+    def transition(self, t, temp_in, temp_wh):
+        """
+        Propagates the temperatures of every home over step t for every
+        combination of HVAC and water heater duty cycles.
+        params
+        temp_in, temp_wh: np.array (homes, n_in, n_wh, 1, 1) of temperatures at step t
+        :return: tuple of np.array (homes, n_in, n_wh, hvac action, wh action), temperatures at t+1 and the cost of step t
+        """
+        e = self.expand
+        hvac = self.hvac_actions.reshape(1, 1, 1, -1, 1)
+        wh = self.wh_actions.reshape(1, 1, 1, 1, -1)
+        cool = hvac * e(self.cooling)
+        heat = hvac * e(self.heating)
+
+        next_temp_in = temp_in + e(self.k_in) * ((e(self.oat[:, t+1]) - temp_in) / e(self.home_r)
+                                                - cool * e(self.hvac_p_c) + heat * e(self.hvac_p_h))
+        temp_wh_mix = e(self.rem[:, t+1]) * temp_wh + e(self.draw[:, t+1] * self.tap_temp)
+        next_temp_wh = temp_wh_mix + e(self.k_wh) * ((next_temp_in - temp_wh_mix) / e(self.wh_r) + wh * e(self.wh_p))
+
+        p_grid = self.sub_subhourly_steps * (e(self.hvac_p_c) * cool + e(self.hvac_p_h) * heat + e(self.wh_p) * wh)
+        cost = e(self.price[:, t]) * p_grid
+        return next_temp_in, next_temp_wh, cost
+
+    def q_values(self, t, temp_in, temp_wh, value):
+        """
+        Cost of step t plus the discounted value of the next state for every
+        combination of duty cycles, with a penalty on temperatures outside of
+        the bounds.
+        :return: np.array (homes, n_in, n_wh, hvac action, wh action)
+        """
+        e = self.expand
+        next_temp_in, next_temp_wh, cost = self.transition(t, temp_in, temp_wh)
+        penalty = self.penalty * (self.violation(next_temp_in, e(self.temp_in_min), e(self.temp_in_max))
+                                + self.violation(next_temp_wh, e(self.temp_wh_min), e(self.temp_wh_max)))
+        return cost + penalty + self.discount * self.interpolate(value, next_temp_in, next_temp_wh)
+
+    def backward_pass(self):
+        """
+        Computes the value function of each step on the temperature grid, from
+        the end of the horizon back to the first step after the current state.
+        :return: list of np.array (homes, grid_points, grid_points), the value function of steps 1 to horizon
+        """
+        temp_in = self.temp_in_grid.reshape(-1, self.grid_points, 1, 1, 1)
+        temp_wh = self.temp_wh_grid.reshape(-1, 1, self.grid_points, 1, 1)
+        values = [np.zeros((len(self.homes), self.grid_points, self.grid_points))]
+        for t in range(self.horizon - 1, 0, -1):
+            q = self.q_values(t, temp_in, temp_wh, values[0])
+            values.insert(0, q.min(axis=(3, 4)))
+        return values
+
+    def forward_pass(self, values):
+        """
+        Follows the optimal duty cycles from the current state of each home,
+        propagating the exact (not discretized) temperatures.
+        :return: tuple of np.array (homes, horizon), HVAC and water heater duty cycles
+        """
+        n = len(self.homes)
+        n_wh = len(self.wh_actions)
+        hvac = np.zeros((n, self.horizon))
+        wh = np.zeros((n, self.horizon))
+        temp_in = self.temp_in_init.reshape(-1, 1, 1, 1, 1)
+        temp_wh = self.temp_wh_init.reshape(-1, 1, 1, 1, 1)
+        for t in range(self.horizon):
+            q = self.q_values(t, temp_in, temp_wh, values[t])
+            if t == 0: # the water heater temperature at the end of the first step without the water draw (MPCCalc.temp_wh)
+                e = self.expand
+                next_temp_in, _, _ = self.transition(t, temp_in, temp_wh)
+                wh_first = temp_wh + e(self.k_wh) * ((next_temp_in - temp_wh) / e(self.wh_r) + self.wh_actions.reshape(1, 1, 1, 1, -1) * e(self.wh_p))
+                q = q + self.penalty * self.violation(wh_first, e(self.temp_wh_min), e(self.temp_wh_max))
+            best = q.reshape(n, -1).argmin(axis=1)
+            hvac[:, t] = self.hvac_actions[best // n_wh]
+            wh[:, t] = self.wh_actions[best % n_wh]
+
+            next_temp_in, next_temp_wh, _ = self.transition(t, temp_in, temp_wh)
+            next_temp_in = np.broadcast_to(next_temp_in, q.shape)
+            temp_in = next_temp_in.reshape(n, -1)[np.arange(n), best].reshape(-1, 1, 1, 1, 1)
+            temp_wh = next_temp_wh.reshape(n, -1)[np.arange(n), best].reshape(-1, 1, 1, 1, 1)
+        return hvac, wh
+
+    def solve(self):
+        """
+        Solves all homes and writes the duty cycles into the CVXPY variables of
+        each home. The temperatures, loads and cost follow from
+        MPCCalc.simulate_plan, the status is infeasible if the plan leaves the
+        temperature bounds.
+        :return: None
+        """
+        values = self.backward_pass()
+        hvac, wh = self.forward_pass(values)
+        for i, home in enumerate(self.homes):
+            home.hvac_cool_on.value = hvac[i] * self.cooling[i]
+            home.hvac_heat_on.value = hvac[i] * self.heating[i]
+            home.wh_heat_on.value = wh[i]
+            home.status = "optimal" if home.simulate_plan() else "infeasible"
@@ -0,0 +1,57 @@
+from pathos.pools import ProcessPool, ThreadPool
+
+class Executor:
+    backends = {"process": ProcessPool, "thread": ThreadPool}
+
+    def __init__(self, backend="process", n_workers=1, chunk_size=0):
+        """
+        Pool of workers created once and reused for every map (e.g. every
+        timestep of the simulation) until it is closed explicitly.
+        params
+        backend: str, 'process' (pathos process pool) or 'thread' (pathos thread pool, in the calling process)
+        n_workers: int, number of workers
+        chunk_size: int, number of items sent to a worker at once, 0 for the default of the pool
+        """
+        if backend not in self.backends:
+            raise ValueError(f"Unknown executor backend: {backend}")
+        self.backend = backend
+        self.n_workers = max(1, int(n_workers))
+        self.chunk_size = int(chunk_size)
+        self.pool = self.backends[backend](nodes=self.n_workers)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Executor set by the simulation section of the config (executor,
+        n_nodes, chunk_size).
+        :return: Executor
+        """
+        sim = config['simulation']
+        return cls(sim.get('executor', 'process'), sim['n_nodes'], sim.get('chunk_size', 0))
+
+    def map(self, f, items):
+        """
+        Calls f on every item on the workers.
+        :return: list, results in the order of the items
+        """
+        if self.chunk_size > 0:
+            return self.pool.map(f, items, chunksize=self.chunk_size)
+        return self.pool.map(f, items)
+
+    def submit(self, f, item):
+        """
+        Calls f on the item on a worker without waiting for the result.
+        :return: AsyncResult (ready, wait, get)
+        """
+        return self.pool.apipe(f, item)
+
+    def close(self):
+        """
+        Stops the workers. The executor cannot be used afterwards.
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool.clear()
+            self.pool = None
@@ -0,0 +1,152 @@
+import time
+import functools
+import threading
+from fnmatch import fnmatchcase
+
+def command(f):
+    """
+    Runs the command under the lock of the store (the homes of the thread
+    executor share it) and counts a direct call as one round-trip (the
+    commands of a pipeline are counted once by LocalPipeline.execute).
+    """
+    @functools.wraps(f)
+    def counted(self, *args, **kwargs):
+        with self.lock:
+            start = time.perf_counter()
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                self.count(time.perf_counter() - start)
+    counted.uncounted = f
+    return counted
+
+class LocalPipeline:
+    """
+    Pipeline of a LocalStore, buffers the commands and runs them on execute
+    (same interface as a redis pipeline).
+    """
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = functools.partial(getattr(type(self.store), name).uncounted, self.store)
+        def buffer(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return buffer
+
+    def execute(self):
+        """
+        Runs the buffered commands at once under the lock of the store, so that
+        other threads see all or none of them (like MULTI/EXEC in redis).
+        """
+        with self.store.lock:
+            start = time.perf_counter()
+            try:
+                return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+            finally:
+                self.commands = []
+                self.store.count(time.perf_counter() - start)
+
+class LocalStore:
+    def __init__(self, count=None):
+        """
+        In-process transport with the subset of the redis commands used by the
+        Aggregator and MPCCalc. Values are kept as python objects, so there is no
+        serialization or socket hop, but the data is only visible to the process
+        which holds the store (all homes must run in the aggregator process).
+        The commands are serialized by a lock, so the store can be shared by
+        threads.
+        params
+        count: function called with the duration (s) of every command and every executed pipeline, the
+            calls which are round-trips with the redis transport (e.g. CountingRedis.count)
+        """
+        self.data = {}
+        self.count = count if count is not None else lambda latency: None
+        self.lock = threading.Lock()
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return LocalPipeline(self)
+
+    @command
+    def flushall(self):
+        self.data = {}
+        return True
+
+    @command
+    def delete(self, *names):
+        return sum(self.data.pop(name, None) is not None for name in names)
+
+    @command
+    def scan_iter(self, match=None, count=None):
+        return [k for k in self.data if match is None or fnmatchcase(k, match)]
+
+    @command
+    def copy(self, source, destination, replace=False):
+        if source not in self.data or destination in self.data and not replace:
+            return False
+        value = self.data[source]
+        self.data[destination] = dict(value) if isinstance(value, dict) else list(value)
+        return True
+
+    @command
+    def get(self, name):
+        return self.data.get(name)
+
+    @command
+    def set(self, name, value):
+        self.data[name] = value
+        return True
+
+    @command
+    def hset(self, name, key=None, value=None, mapping=None):
+        h = self.data.setdefault(name, {})
+        n = len(h)
+        if key is not None:
+            h[key] = value
+        if mapping:
+            h.update(mapping)
+        return len(h) - n
+
+    @command
+    def hsetnx(self, name, key, value):
+        h = self.data.setdefault(name, {})
+        if key in h:
+            return False
+        h[key] = value
+        return True
+
+    @command
+    def hexists(self, name, key):
+        return key in self.data.get(name, {})
+
+    @command
+    def hget(self, name, key):
+        return self.data.get(name, {}).get(key)
+
+    @command
+    def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    @command
+    def hmget(self, name, keys):
+        h = self.data.get(name, {})
+        return [h.get(k) for k in keys]
+
+    @command
+    def hincrbyfloat(self, name, key, amount=1.0):
+        h = self.data.setdefault(name, {})
+        h[key] = h.get(key, 0.0) + float(amount)
+        return h[key]
+
+    @command
+    def rpush(self, name, *values):
+        l = self.data.setdefault(name, [])
+        l.extend(values)
+        return len(l)
+
+    @command
+    def lrange(self, name, start, end):
+        l = self.data.get(name, [])
+        return l[start:] if end == -1 else l[start:end + 1]
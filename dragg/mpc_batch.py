@@ -0,0 +1,112 @@
+import cvxpy as cp
+
+from dragg.dp_solver import DPSolver
+from dragg.rule_based import RuleBasedController
+
+def manage_batch(batch):
+    """
+    Calls class method as a top level function (picklizable by pathos)
+    :return: None
+    """
+    batch.run_batch()
+    return
+
+class MPCBatch:
+    def __init__(self, homes):
+        """
+        params
+        homes: List of MPCCalc homes which are set up and solved together in one process
+        """
+        self.homes = homes
+        self.dp_homes = [home for home in homes if home.dp] # solved together by dynamic programming
+        self.rule_based_homes = [home for home in homes if home.rule_based] # controlled together without MPC
+        self.mpc_homes = [home for home in homes if not (home.dp or home.rule_based)]
+        self.dp_chunk = 64 # homes per vectorized DP solve, bounds the memory of the value arrays
+        self.solver = homes[0].solver
+        self.verbose_flag = homes[0].verbose_flag
+        self.parametrized = all(home.parametrized for home in self.mpc_homes)  # stacked problem can be built once
+        self.prob = None
+        self.status = None
+
+    def setup_batch_problem(self):
+        """
+        Stacks the MPC problems of all homes into one block-diagonal problem. The
+        homes share no variables or constraints, so minimizing the sum of their
+        objectives solves every home's problem at once.
+        :return: None
+        """
+        obj = cp.Minimize(cp.sum([home.obj.args[0] for home in self.mpc_homes]))
+        constraints = [c for home in self.mpc_homes for c in home.prob.constraints]
+        self.prob = cp.Problem(obj, constraints)
+
+    def solve_batch(self):
+        """
+        Solves the stacked problem and passes the status on to each home. If the
+        stacked problem cannot be solved the homes are solved one by one, so that
+        only the failing homes revert to the fallback in cleanup_and_finish. Homes
+        in relaxed mode whose duty cycles cannot be repaired are also re-solved.
+        :return: None
+        """
+        if self.prob is None or not self.parametrized:
+            self.setup_batch_problem()
+        try:
+            self.prob.solve(solver=self.solver, verbose=self.verbose_flag)
+        except:
+            pass
+        self.status = self.prob.status
+
+        if self.status in cp.settings.SOLUTION_PRESENT:
+            for home in self.mpc_homes:
+                home.solved = True
+                home.status = self.status
+                home.tier = 0
+                if home.relaxed and not home.repair_relaxed_solution({k: getattr(home, k).value for k in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]}):
+                    home.solve_mpc()
+        else:
+            for home in self.mpc_homes:
+                home.solve_mpc()
+
+    def solve_dp(self):
+        """
+        Solves the base homes in dp mode with one vectorized dynamic program per
+        chunk of homes. Homes whose plan leaves the temperature bounds continue
+        with the next solver tier.
+        :return: None
+        """
+        for i in range(0, len(self.dp_homes), self.dp_chunk):
+            homes = self.dp_homes[i:i + self.dp_chunk]
+            DPSolver(homes, homes[0].dp_grid_points, homes[0].dp_penalty).solve()
+        for home in self.dp_homes:
+            home.solved = True
+            home.tier = 0
+            if not home.status in cp.settings.SOLUTION_PRESENT:
+                home.log.warning(f"Solver DP ended with status {home.status} for house {home.name}.")
+                home.solve_mpc(start_tier=1)
+
+    def run_batch(self, timestep=None, reward_price=None):
+        """
+        Runs all homes in the batch for the current timestep. Homes in rule_based
+        mode are controlled by one vectorized thermostat and base homes in dp
+        mode are solved by vectorized dynamic programming. Continuous problems
+        are solved as one stacked problem. Mixed-integer problems are solved block
+        by block: branch and bound on the stacked problem has to close the gap of
+        all homes at once, which is much slower than solving each home.
+        params
+        timestep, reward_price: passed on to MPCCalc.setup_home (read from redis if None)
+        :return: None
+        """
+        for home in self.homes:
+            home.setup_home(timestep, reward_price)
+
+        if self.rule_based_homes:
+            RuleBasedController(self.rule_based_homes).solve()
+        if self.dp_homes:
+            self.solve_dp()
+        if self.mpc_homes and self.mpc_homes[0].prob is not None and not self.mpc_homes[0].prob.is_mixed_integer():
+            self.solve_batch()
+        else:
+            for home in self.mpc_homes:
+                home.solve_mpc()
+
+        for home in self.homes:
+            home.finish_home()
@@ -11,6 +11,10 @@ import json
 from copy import deepcopy
 
 from dragg.redis_client import RedisClient
+from dragg.sparse_milp import SparseMILP
+from dragg.dp_solver import DPSolver
+from dragg.rule_based import RuleBasedController
+from dragg.shared_data import attach_data
 from dragg.logger import Logger
 
 def manage_home(home):
@@ -21,20 +25,44 @@ def manage_home(home):
     home.run_home()
     return
 
+def manage_home_at(args):
+    """
+    Calls class method as a top level function (picklizable by pathos) for a
+    given timestep and reward price, with the results claimed against the
+    deadline of the timestep (see Aggregator.run_deadline_iteration).
+    :return: None
+    """
+    home, timestep, reward_price = args
+    home.run_home(timestep, reward_price, claim_results=True)
+    return
+
 class MPCCalc:
-    def __init__(self, home):
+    total_keys = ["p_grid_opt", "forecast_p_grid_opt", "cost_opt", "round_trips"] # summed over the community on the server
+    # solvers which accept the shifted plan of the previous timestep as a starting point
+    # (scipy.optimize.milp of the SCIPY_MILP backend takes no starting point)
+    warm_start_solvers = [cp.GUROBI]
+
+    def __init__(self, home, noise_seed=None):
         """
         params
         home: Dictionary with keys for HVAC, WH, and optionally PV, battery parameters
+        noise_seed: np.random.SeedSequence (or int) of the home's forecast errors, None for a random seed
         """
         self.home = home  # reset every time home retrieved from Queue
         self.name = home['name']
         self.type = self.home['type']  # reset every time home retrieved from Queue
         self.start_hour_index = None  # set once upon thread init
         self.current_values = None  # set once upon thread init
-        self.all_ghi = None  # list, all values in the GHI list, set once upon thread init
-        self.all_oat = None  # list, all values in the OAT list, set once upon thread init
+        self.all_ghi = None  # array, all values in the GHI list, set once upon thread init
+        self.all_oat = None  # array, all values in the OAT list, set once upon thread init
         self.all_spp = None  # list, all values in the SPP list, set once upon thread init
+        self.env_data = None  # descriptor of the environmental data in shared memory, if published by the aggregator
+        self.run_id = RedisClient().run_id  # run ID of the aggregator, prefix of the redis keys of the simulation
+        if not isinstance(noise_seed, np.random.SeedSequence):
+            noise_seed = np.random.SeedSequence(noise_seed)
+        self.noise_seed = noise_seed
+        self.oat_noise_scale = None  # array (horizon) of the growth of the OAT forecast errors, set on first use
+        self.ghi_noise = None
         self.home_r = None
         self.home_c = None
         self.hvac_p_c = None
@@ -76,7 +104,19 @@ class MPCCalc:
         self.assumed_wh_draw = None
         self.prev_optimal_vals = None  # set after timestep > 0, set_vals_for_current_run
         self.timestep = 0
+        self.sim_timestep = 0
+        self.claim_results = False  # results are only written if claimed first (deadline of the timestep)
+        self.late = 0  # 1 if the home missed the deadline of the timestep and the fallback was written for it
         self.p_grid_opt = None
+        self.prob = None
+        self.status = None
+        self.rule_based_vals = None
+        self.received_reward_price = None
+
+        # plans over the horizon are stored as {k}_{j} text fields or one packed float32/float64 blob per field
+        self.plan_encoding = self.home['hems'].get('plan_encoding', 'text')
+        self.plans = {}
+        self.prev_plans = {}
 
         # setup cvxpy verbose solver
         self.verbose_flag = os.environ.get('VERBOSE','False')
@@ -85,6 +125,9 @@ class MPCCalc:
         else:
             self.verbose_flag = True
 
+        # build the MPC problem once with parameters, update their values every timestep
+        self.parametrized = bool(self.home['hems'].get('parametrized', False))
+
         # calls redis and gets all the environmental variables from beginning of simulation to end
         self.initialize_environmental_variables()
 
@@ -96,40 +139,123 @@ class MPCCalc:
         if 'pv' in self.type:
             # setup the pv variables
             self.setup_pv_problem()
+        if self.sparse:
+            self.setup_sparse_problem()
+        elif self.dp:
+            self.cost = cp.Variable(self.horizon) # holds the cost of the DP plan
+        elif self.parametrized:
+            self.setup_parametrized_problem()
+
+        # sampled relaxed homes are also solved exactly to report the objective gap
+        self.gap_check = self.relaxed and self.gap_sample > 0 and np.random.uniform() < self.gap_sample
 
     def redis_write_optimal_vals(self):
         """
-        Sends the optimal values for each home to the redis server.
-        :return: None
+        Sends the optimal values for each home to the redis server in a single
+        multi-field write, together with the number of round-trips to redis
+        the home made this timestep. The community totals of the timestep are
+        accumulated on the server in the same round-trip. With claim_results,
+        the results are first claimed against the late fallback of the
+        aggregator, which waits for the write of a home holding the claim.
+        :return: bool, False if the fallback claimed the results first
+        """
+        key = self.redis_client.key(self.name)
+        if self.claim_results and not self.redis_client.conn.hsetnx(self.claims_key(), self.name, self.late):
+            self.log.warning(f"Results of timestep {self.sim_timestep} finished after the deadline, the fallback was used.")
+            self.plans = {}
+            return False
+        self.optimal_vals["late"] = self.late
+        self.optimal_vals["round_trips"] = self.round_trips + 1
+        totals = {k: self.optimal_vals[k] for k in self.total_keys}
+        totals["homes"] = 1
+        totals = (self.redis_client.key(f"totals:{self.sim_timestep}"), totals)
+        plans = self.plans if self.plan_encoding != "text" else None
+        self.redis_client.write_plans(key, plans, self.plan_encoding, mapping=self.optimal_vals, totals=totals)
+        self.plans = {}
+        return True
+
+    def claims_key(self, timestep=None):
         """
-        key = self.name
-        for field, value in self.optimal_vals.items():
-            self.redis_client.conn.hset(key, field, value)
+        Key of the hash of the homes whose results of the timestep have been
+        written (by the home or, if it was late, by the aggregator).
+        :return: str
+        """
+        return self.redis_client.key(f"claims:{self.sim_timestep if timestep is None else timestep}")
 
     def redis_get_prev_optimal_vals(self):
         """
         Collects starting point environmental values for all homes (such as current temperature).
         :return: None
         """
-        key = self.name
-        self.prev_optimal_vals = self.redis_client.conn.hgetall(key)
+        key = self.redis_client.key(self.name)
+        if self.plan_encoding == "text":
+            self.prev_optimal_vals = self.redis_client.conn.hgetall(key)
+        else:
+            self.prev_optimal_vals, self.prev_plans = self.redis_client.read_plans(key, self.plan_encoding)
+
+    def prev_plan(self, k):
+        """
+        Plan of the last feasible solve for the optimal value k, stored as
+        {k}_{j} text fields or as a packed blob (plan_encoding).
+        :return: np.array, values over the horizon (KeyError if there is no plan)
+        """
+        if self.plan_encoding == "text":
+            return np.array([float(self.prev_optimal_vals[f"{k}_{j}"]) for j in range(self.horizon)])
+        return self.prev_plans[k]
 
     def initialize_environmental_variables(self):
         self.redis_client = RedisClient()
 
         # collect all values necessary
-        self.start_hour_index = self.redis_client.conn.get('start_hour_index')
-        self.all_ghi = self.redis_client.conn.lrange('GHI', 0, -1)
-        self.all_oat = self.redis_client.conn.lrange('OAT', 0, -1)
-        self.all_spp = self.redis_client.conn.lrange('SPP', 0, -1)
-        self.all_tou = self.redis_client.conn.lrange('tou', 0, -1)
+        self.start_hour_index = self.redis_client.conn.get(self.redis_client.key('start_hour_index'))
+        self.env_data = self.redis_client.conn.hgetall(self.redis_client.key('env_data'))
+        if self.env_data: # published once by the aggregator as shared memory
+            self.attach_environmental_variables()
+        else:
+            self.all_ghi = self.redis_client.conn.lrange(self.redis_client.key('GHI'), 0, -1)
+            self.all_oat = self.redis_client.conn.lrange(self.redis_client.key('OAT'), 0, -1)
+            self.all_spp = self.redis_client.conn.lrange(self.redis_client.key('SPP'), 0, -1)
+            self.all_tou = self.redis_client.conn.lrange(self.redis_client.key('tou'), 0, -1)
+
+            # cast all values to proper type
+            self.all_ghi = np.array([float(i) for i in self.all_ghi])
+            self.all_oat = np.array([float(i) for i in self.all_oat])
+            self.all_spp = [float(i) for i in self.all_spp]
         self.base_cents = float(self.all_tou[0])
-
-        # cast all values to proper type
         self.start_hour_index = int(float(self.start_hour_index))
-        self.all_ghi = [float(i) for i in self.all_ghi]
-        self.all_oat = [float(i) for i in self.all_oat]
-        self.all_spp = [float(i) for i in self.all_spp]
+
+    def attach_environmental_variables(self):
+        """
+        Attaches read-only to the environmental data published by the aggregator
+        (shared_data.publish_data). The GHI, OAT, SPP and TOU values are views of
+        the shared memory, so homes do not hold copies of the data.
+        :return: None
+        """
+        data = attach_data(self.env_data)
+        empty = np.zeros(0)
+        self.all_ghi = data["GHI"]
+        self.all_oat = data["OAT"]
+        self.all_spp = data.get("SPP", empty)
+        self.all_tou = data.get("tou", empty)
+
+    def __getstate__(self):
+        """
+        Leaves the shared environmental data and the redis client out of the
+        pickled home (e.g. for the process pool); the data is attached again and
+        the client of the receiving process is used when the home is unpickled.
+        """
+        state = self.__dict__.copy()
+        state.pop("redis_client", None)
+        if state.get("env_data"):
+            for k in ["all_ghi", "all_oat", "all_spp", "all_tou"]:
+                state.pop(k, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.redis_client = RedisClient()
+        if state.get("env_data"):
+            self.attach_environmental_variables()
 
     def setup_base_problem(self):
         """
@@ -138,12 +264,41 @@ class MPCCalc:
         :return: None
         """
         # Set up the solver parameters
-        solvers = {"GUROBI": cp.GUROBI, "GLPK_MI": cp.GLPK_MI, "ECOS": cp.ECOS}
+        solvers = {"GUROBI": cp.GUROBI, "GLPK_MI": cp.GLPK_MI, "ECOS": cp.ECOS, "SCIPY_MILP": "SCIPY_MILP"}
         try:
             self.solver = solvers[self.home['hems']['solver']]
         except:
             self.solver = cp.GLPK_MI
 
+        # "relaxed" solves the continuous relaxation and repairs the duty cycles to integers,
+        # "dp" solves base homes by dynamic programming instead of the MILP
+        self.mode = self.home['hems'].get('mode', 'mpc')
+        self.relaxed = self.mode == 'relaxed'
+        self.gap_sample = float(self.home['hems'].get('relaxed_gap_sample', 0)) # fraction of homes checked against the exact MILP
+        self.dp = self.mode == 'dp' and self.type == 'base'
+        self.dp_grid_points = int(self.home['hems'].get('dp_grid_points', 21))
+        self.dp_penalty = float(self.home['hems'].get('dp_penalty', DPSolver.PENALTY))
+        self.rule_based = self.mode == 'rule_based' # thermostat control only, no MPC
+
+        # the sparse MILP backend assembles its own matrices instead of a CVXPY problem
+        self.sparse = self.solver == "SCIPY_MILP"
+        self.parametrized = self.parametrized and not (self.sparse or self.dp or self.rule_based)
+
+        # Solvers tried in order until one finds a solution, before the rule based fallback
+        # ("RELAXED" solves the LP relaxation and rounds the duty cycles)
+        self.solver_tiers = [self.solver] + [solvers.get(t, t) for t in self.home['hems'].get('fallback_solvers', [])]
+        if self.dp:
+            self.solver_tiers[0] = "DP"
+        if self.rule_based:
+            self.solver_tiers = []
+        self.time_limit = float(self.home['hems'].get('time_limit', 0)) # seconds per solve, 0 = no limit
+        self.mip_gap = float(self.home['hems'].get('mip_gap', 0)) # relative MIP gap, 0 = solver default
+        self.tier = 0
+        self.milp = None
+
+        self.warm_start = bool(self.home['hems'].get('warm_start', False)) and self.solver in self.warm_start_solvers
+        self.warm_started = False
+
         # Set up the horizon for the MPC calc (min horizon = 1, no MPC)
         self.sub_subhourly_steps = max(1, int(self.home['hems']['sub_subhourly_steps']))
         self.dt = max(1, int(self.home['hems']['hourly_agg_steps']))
@@ -168,9 +323,9 @@ class MPCCalc:
         self.temp_wh_ev = cp.Variable(self.h_plus)
         self.temp_wh = cp.Variable(1)
         self.p_grid = cp.Variable(self.horizon)
-        self.hvac_cool_on = cp.Variable(self.horizon, integer=True)
-        self.hvac_heat_on = cp.Variable(self.horizon, integer=True)
-        self.wh_heat_on = cp.Variable(self.horizon, integer=True)
+        self.hvac_cool_on = cp.Variable(self.horizon, integer=not self.relaxed)
+        self.hvac_heat_on = cp.Variable(self.horizon, integer=not self.relaxed)
+        self.wh_heat_on = cp.Variable(self.horizon, integer=not self.relaxed)
 
         # Water heater temperature constraints
         self.temp_wh_min = cp.Constant(float(self.home["wh"]["temp_wh_min"]))
@@ -190,6 +345,83 @@ class MPCCalc:
 
         self.max_load = (max(self.hvac_p_c.value, self.hvac_p_h.value) + self.wh_p.value) * self.sub_subhourly_steps
 
+        # Bounds on the duty cycles (HVAC maximums are set by season each timestep)
+        self.hvac_heat_min = 0
+        self.hvac_cool_min = 0
+        self.wh_heat_max = self.sub_subhourly_steps
+        self.wh_heat_min = 0
+
+    def setup_parametrized_problem(self):
+        """
+        Replaces the values that change every timestep (initial temperatures,
+        forecasts, water draws, price and battery state) with CVXPY parameters
+        and builds the MPC problem once. Each timestep only the parameter values
+        are updated before re-solving, so CVXPY can reuse the canonicalization
+        of the problem.
+        :return: None
+        """
+        self.temp_in_init = cp.Parameter()
+        self.temp_wh_init = cp.Parameter()
+        self.oat_forecast = cp.Parameter(self.h_plus)
+        self.ghi_forecast = cp.Parameter(self.h_plus)
+        self.draw_frac = cp.Parameter(self.h_plus)
+        self.remainder_frac = cp.Parameter(self.h_plus)
+        self.total_price = cp.Parameter(self.horizon)
+        self.hvac_heat_ub = cp.Parameter(nonneg=True)
+        self.hvac_cool_ub = cp.Parameter(nonneg=True)
+        if 'battery' in self.type:
+            self.e_batt_init = cp.Parameter()
+
+        self.add_type_constraints()
+        self.set_type_p_grid()
+        self.set_mpc_objective()
+
+    def setup_sparse_problem(self):
+        """
+        Sets up the sparse MILP backend (scipy.optimize.milp with HiGHS), which
+        assembles the MPC problem directly as sparse matrices every timestep.
+        The CVXPY variables are only used to hold the solution.
+        :return: None
+        """
+        self.cost = cp.Variable(self.horizon)
+        self.milp = SparseMILP(self)
+
+    def solver_options(self, solver):
+        """
+        Translates the per-solve time limit and MIP gap into the options of the
+        given solver.
+        :return: dict
+        """
+        opts = {}
+        if solver == cp.GUROBI:
+            if self.time_limit:
+                opts["TimeLimit"] = self.time_limit
+            if self.mip_gap:
+                opts["MIPGap"] = self.mip_gap
+        elif solver == cp.GLPK_MI:
+            if self.time_limit:
+                opts["tm_lim"] = int(1000 * self.time_limit)
+            if self.mip_gap:
+                opts["mip_gap"] = self.mip_gap
+        elif solver in ["SCIPY_MILP", "RELAXED"]:
+            if self.time_limit:
+                opts["time_limit"] = self.time_limit
+            if self.mip_gap:
+                opts["mip_rel_gap"] = self.mip_gap
+        return opts
+
+    def set_value(self, attr, value):
+        """
+        Sets a value of the MPC problem that changes every timestep. For a
+        parametrized problem the value of the existing parameter is updated,
+        otherwise the attribute is replaced with a new constant.
+        :return: None
+        """
+        if self.parametrized:
+            getattr(self, attr).value = value
+        else:
+            setattr(self, attr, cp.Constant(value))
+
     def water_draws(self):
         draw_sizes = (self.horizon // self.dt + 1) * [0] + self.home["wh"]["draw_sizes"]
         raw_draw_size_list = draw_sizes[(self.timestep // self.dt):(self.timestep // self.dt) + (self.horizon // self.dt + 1)]
@@ -200,8 +432,30 @@ class MPCCalc:
 
         self.draw_size = draw_size_list
         df = np.divide(self.draw_size, self.wh_size)
-        self.draw_frac = cp.Constant(df)
-        self.remainder_frac = cp.Constant(1-df)
+        self.set_value('draw_frac', df)
+        self.set_value('remainder_frac', 1-df)
+
+    def setup_forecast_noise(self):
+        """
+        Sets the growth of the forecast errors over the horizon: OAT errors grow
+        by a factor of 1.1 per step, GHI forecasts are 1% high, growing by a
+        factor of 1.3 per step.
+        :return: None
+        """
+        self.oat_noise_scale = np.power(1.1, np.arange(self.horizon))
+        self.ghi_noise = 1 + 0.01 * np.power(1.3, np.arange(self.horizon))
+
+    def oat_noise(self, timestep):
+        """
+        Draws the OAT forecast errors over the horizon at timestep from the
+        home's own random stream for the timestep (noise_seed spawned by the
+        timestep), so that forecasts do not depend on the worker, the order in
+        which homes are solved or on the earlier timesteps run by the process.
+        Only the errors of the timestep are drawn.
+        :return: np.array (horizon)
+        """
+        seed = np.random.SeedSequence(self.noise_seed.entropy, spawn_key=self.noise_seed.spawn_key + (timestep,))
+        return np.random.default_rng(seed).standard_normal(self.horizon) * self.oat_noise_scale
 
     def set_environmental_variables(self):
         """
@@ -212,23 +466,45 @@ class MPCCalc:
         end_slice = start_slice + self.horizon + 1 # Need to extend 1 timestep past horizon for OAT slice
 
         # Get the current values from a list of all values
+        if self.oat_noise_scale is None:
+            self.setup_forecast_noise()
+
         self.ghi_current = self.all_ghi[start_slice:end_slice]
-        self.ghi_current_ev = deepcopy(self.ghi_current)
-        ghi_noise = np.multiply(self.ghi_current[1:], 0.01 * np.power(1.3*np.ones(self.horizon), np.arange(self.horizon)))
-        self.ghi_current_ev[1:] = np.add(self.ghi_current[1:], ghi_noise)
+        self.ghi_current_ev = self.ghi_current.copy()
+        self.ghi_current_ev[1:] *= self.ghi_noise
 
         self.oat_current = self.all_oat[start_slice:end_slice]
-        self.oat_current_ev = deepcopy(self.oat_current)
-        oat_noise = np.multiply(np.power(1.1*np.ones(self.horizon), np.arange(self.horizon)), np.random.randn(self.horizon))
-        self.oat_current_ev[1:] = np.add(self.oat_current[1:], oat_noise)
+        self.oat_current_ev = self.oat_current.copy()
+        self.oat_current_ev[1:] += self.oat_noise(self.timestep)
 
         self.tou_current = self.all_tou[start_slice:end_slice]
         self.base_price = np.array(self.tou_current, dtype=float)
 
         # Set values as cvxpy values
-        self.oat_forecast = cp.Constant(self.oat_current)
-        self.ghi_forecast = cp.Constant(self.ghi_current)
+        self.set_value('oat_forecast', self.oat_current)
+        self.set_value('ghi_forecast', self.ghi_current)
         self.cast_redis_curr_rps()
+        self.set_hvac_bounds()
+
+        # set total price for electricity
+        self.set_value('total_price', np.array(self.reward_price, dtype=float) + self.base_price[:self.horizon])
+
+    def set_hvac_bounds(self):
+        """
+        Sets the upper bounds on the HVAC duty cycles, allowing either heating
+        or cooling depending on the season of the forecasted OAT.
+        :return: None
+        """
+        if max(self.oat_current_ev) <= 30: # "winter"
+            self.hvac_heat_max = self.sub_subhourly_steps
+            self.hvac_cool_max = 0
+
+        else: # "summer"
+            self.hvac_heat_max = 0
+            self.hvac_cool_max = self.sub_subhourly_steps
+
+        self.set_value('hvac_heat_ub', self.hvac_heat_max)
+        self.set_value('hvac_cool_ub', self.hvac_cool_max)
 
     def setup_battery_problem(self):
         """
@@ -267,47 +543,65 @@ class MPCCalc:
         if self.timestep == 0:
             self.initialize_environmental_variables()
 
-            self.temp_in_init = cp.Constant(self.t_in_init)
-            self.temp_wh_init = cp.Constant((self.t_wh_init*(self.wh_size - self.draw_size[0]) + self.tap_temp * self.draw_size[0]) / self.wh_size)
+            self.set_value('temp_in_init', self.t_in_init)
+            self.set_value('temp_wh_init', (self.t_wh_init*(self.wh_size - self.draw_size[0]) + self.tap_temp * self.draw_size[0]) / self.wh_size)
 
             if 'battery' in self.type:
-                self.e_batt_init = cp.Constant(float(self.home["battery"]["e_batt_init"]) * self.batt_cap_total.value)
+                self.set_value('e_batt_init', float(self.home["battery"]["e_batt_init"]) * self.batt_cap_total.value)
                 self.p_batt_ch_init = cp.Constant(0)
 
             self.counter = 0
 
         else:
-            self.temp_in_init = cp.Constant(float(self.prev_optimal_vals["temp_in_opt"]))
-            self.temp_wh_init = cp.Constant((float(self.prev_optimal_vals["temp_wh_opt"])*(self.wh_size - self.draw_size[0]) + self.tap_temp * self.draw_size[0]) / self.wh_size)
+            self.set_value('temp_in_init', float(self.prev_optimal_vals["temp_in_opt"]))
+            self.set_value('temp_wh_init', (float(self.prev_optimal_vals["temp_wh_opt"])*(self.wh_size - self.draw_size[0]) + self.tap_temp * self.draw_size[0]) / self.wh_size)
 
             if 'battery' in self.type:
-                self.e_batt_init = cp.Constant(float(self.home["battery"]["e_batt_init"]))
-                self.e_batt_init = cp.Constant(float(self.prev_optimal_vals["e_batt_opt"]))
+                self.set_value('e_batt_init', float(self.prev_optimal_vals["e_batt_opt"]))
                 self.p_batt_ch_init = cp.Constant(float(self.prev_optimal_vals["p_batt_ch"])
                                                 - float(self.prev_optimal_vals["p_batt_disch"]))
 
             self.counter = int(self.prev_optimal_vals["solve_counter"])
 
+    def set_warm_start(self):
+        """
+        Shifts the plan of the last feasible solve (stored in redis, see
+        prev_plan) to the current timestep and sets it as the starting value of the
+        HVAC/WH duty cycles and battery charge/discharge. Falls back to a cold
+        start if there is no previous plan.
+        :return: None
+        """
+        self.warm_started = False
+        if not self.warm_start or self.timestep == 0:
+            return
+
+        shift = int(self.prev_optimal_vals["solve_counter"]) + 1 # plan is from timestep t-solve_counter-1
+        if shift >= self.horizon: # the previous plan has run out
+            return
+        plan_vars = [(self.hvac_cool_on, "hvac_cool_on_opt", self.sub_subhourly_steps, self.hvac_cool_max),
+                    (self.hvac_heat_on, "hvac_heat_on_opt", self.sub_subhourly_steps, self.hvac_heat_max),
+                    (self.wh_heat_on, "wh_heat_on_opt", self.sub_subhourly_steps, self.wh_heat_max)]
+        if 'battery' in self.type:
+            plan_vars += [(self.p_batt_ch, "p_batt_ch", None, None),
+                        (self.p_batt_disch, "p_batt_disch", None, None)]
+
+        try:
+            for var, k, steps, var_max in plan_vars:
+                # repeat the last step of the plan past the end of the previous horizon
+                plan = self.prev_plan(k)[np.minimum(np.arange(self.horizon) + shift, self.horizon - 1)]
+                if steps:
+                    plan = np.clip(np.round(plan * steps), 0, var_max)
+                var.value = plan
+        except KeyError: # no feasible solve yet
+            return
+        self.warm_started = True
+
     def add_base_constraints(self):
         """
         Creates the system dynamics for thermal energy storage systems: HVAC and
         water heater.
         :return: None
         """
-
-        self.hvac_heat_min = 0
-        self.hvac_cool_min = 0
-        self.wh_heat_max = self.sub_subhourly_steps
-        self.wh_heat_min = 0
-        # Set constraints on HVAC by season
-        if max(self.oat_current_ev) <= 30: # "winter"
-            self.hvac_heat_max = self.sub_subhourly_steps
-            self.hvac_cool_max = 0
-
-        else: # "summer"
-            self.hvac_heat_max = 0
-            self.hvac_cool_max = self.sub_subhourly_steps
-
         self.constraints = [
             # Indoor air temperature constraints
             self.temp_in_ev[0] == self.temp_in_init,
@@ -319,7 +613,7 @@ class MPCCalc:
             self.temp_in_ev[1:self.h_plus] <= self.temp_in_max,
 
             self.temp_in == self.temp_in_init
-                            + 3600 * (((self.oat_current[1] - self.temp_in_init) / self.home_r)
+                            + 3600 * (((self.oat_forecast[1] - self.temp_in_init) / self.home_r)
                             - self.hvac_cool_on[0] * self.hvac_p_c
                             + self.hvac_heat_on[0] * self.hvac_p_h) / (self.home_c * self.dt),
             self.temp_in <= self.temp_in_max,
@@ -341,17 +635,15 @@ class MPCCalc:
 
             self.p_load ==  self.sub_subhourly_steps * (self.hvac_p_c * self.hvac_cool_on + self.hvac_p_h * self.hvac_heat_on + self.wh_p * self.wh_heat_on),
 
-            self.hvac_cool_on <= self.hvac_cool_max,
+            # Set constraints on HVAC by season
+            self.hvac_cool_on <= self.hvac_cool_ub,
             self.hvac_cool_on >= self.hvac_cool_min,
-            self.hvac_heat_on <= self.hvac_heat_max,
+            self.hvac_heat_on <= self.hvac_heat_ub,
             self.hvac_heat_on >= self.hvac_heat_min,
             self.wh_heat_on <= self.wh_heat_max,
             self.wh_heat_on >= self.wh_heat_min
         ]
 
-        # set total price for electricity
-        self.total_price = cp.Constant(np.array(self.reward_price, dtype=float) + self.base_price[:self.horizon])
-
     def add_battery_constraints(self):
         """
         Creates the system dynamics for chemical energy storage.
@@ -431,11 +723,10 @@ class MPCCalc:
             self.p_grid == self.p_load + self.sub_subhourly_steps * (self.p_batt_ch + self.p_batt_disch - self.p_pv)
         ]
 
-    def solve_mpc(self):
+    def set_mpc_objective(self):
         """
         Sets the objective function of the Home Energy Management System to be the
-        minimization of cost over the MPC time horizon and solves via CVXPY.
-        Used for all home types.
+        minimization of cost over the MPC time horizon. Used for all home types.
         :return: None
         """
         self.cost = cp.Variable(self.horizon)
@@ -445,13 +736,191 @@ class MPCCalc:
         self.weights = cp.Constant(np.power(self.discount*np.ones(self.horizon), np.arange(self.horizon)))
         self.obj = cp.Minimize(cp.sum(cp.multiply(self.cost, self.weights))) #+ self.wh_weighting * cp.sum(cp.abs(self.temp_wh_max - self.temp_wh_ev))) #cp.sum(self.temp_wh_sp - self.temp_wh_ev))
         self.prob = cp.Problem(self.obj, self.constraints)
-        if not self.prob.is_dcp():
-            self.log.error("Problem is not DCP")
+
+    def setup_cvxpy_problem(self):
+        """
+        Builds the CVXPY problem for the current timestep.
+        :return: None
+        """
+        self.add_type_constraints()
+        self.set_type_p_grid()
+        self.set_mpc_objective()
+
+    def solve_tier(self, solver):
+        """
+        Solves the MPC problem with one solver tier: a CVXPY solver, the sparse
+        MILP backend, the repaired LP relaxation or dynamic programming (base
+        homes). Records the solver status.
+        :return: None
+        """
+        opts = self.solver_options(solver)
+        relaxed = self.relaxed or solver == "RELAXED"
         try:
-            self.prob.solve(solver=self.solver, verbose=self.verbose_flag)
+            if solver == "DP":
+                DPSolver([self], self.dp_grid_points, self.dp_penalty).solve()
+            elif solver in ["SCIPY_MILP", "RELAXED"]:
+                if self.milp is None:
+                    self.milp = SparseMILP(self)
+                self.milp.solve(options=opts, relaxed=relaxed)
+                self.status = self.milp.status
+                if relaxed and self.status in cp.settings.SOLUTION_PRESENT:
+                    duty_cycles = self.milp.duty_cycles
+            else:
+                if self.prob is None:
+                    self.setup_cvxpy_problem()
+                if not self.prob.is_dcp():
+                    self.log.error("Problem is not DCP")
+                self.prob.solve(solver=solver, verbose=self.verbose_flag, warm_start=self.warm_started, **opts)
+                self.status = self.prob.status
+                if relaxed and self.status in cp.settings.SOLUTION_PRESENT:
+                    duty_cycles = {k: getattr(self, k).value for k in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]}
+            if relaxed and self.status in cp.settings.SOLUTION_PRESENT and not self.repair_relaxed_solution(duty_cycles):
+                self.status = "infeasible"
             self.solved = True
         except:
             self.solved = False
+            self.status = "solver_error"
+
+    def solve_mpc(self, start_tier=0):
+        """
+        Solves the MPC problem with each solver tier in turn until one finds a
+        solution and records the tier the home ended on. If no tier finds a
+        solution, cleanup_and_finish reverts to the rule based fallback
+        (tier = number of solver tiers).
+        params
+        start_tier: int, index of the first solver tier to try
+        :return: None
+        """
+        for i, solver in enumerate(self.solver_tiers[start_tier:], start_tier):
+            self.tier = i
+            self.solve_tier(solver)
+            if self.status in cp.settings.SOLUTION_PRESENT:
+                return
+            self.log.warning(f"Solver {solver} ended with status {self.status} for house {self.name}.")
+        self.tier = len(self.solver_tiers)
+
+    def simulate_plan(self):
+        """
+        Propagates the dynamics of add_base_constraints for the current values of
+        the duty cycles (and battery and PV variables) and sets the values of the
+        temperatures, loads and cost.
+        :return: bool, True if all temperatures are within bounds
+        """
+        k_in = 3600 / (self.home_c.value * self.dt)
+        k_wh = 3600 / (self.wh_c.value * self.dt)
+        oat = np.asarray(self.oat_forecast.value, dtype=float)
+        rem = np.asarray(self.remainder_frac.value, dtype=float)
+        draw = np.asarray(self.draw_frac.value, dtype=float)
+        cool, heat, wh = self.hvac_cool_on.value, self.hvac_heat_on.value, self.wh_heat_on.value
+
+        temp_in = np.zeros(self.h_plus)
+        temp_wh = np.zeros(self.h_plus)
+        temp_in[0] = self.temp_in_init.value
+        temp_wh[0] = self.temp_wh_init.value
+        for t in range(self.horizon):
+            temp_in[t+1] = temp_in[t] + k_in * ((oat[t+1] - temp_in[t]) / self.home_r.value
+                                                - cool[t] * self.hvac_p_c.value
+                                                + heat[t] * self.hvac_p_h.value)
+            temp_wh_mix = rem[t+1] * temp_wh[t] + draw[t+1] * self.tap_temp
+            temp_wh[t+1] = temp_wh_mix + k_wh * ((temp_in[t+1] - temp_wh_mix) / self.wh_r.value
+                                                + wh[t] * self.wh_p.value)
+
+        p_load = self.sub_subhourly_steps * (self.hvac_p_c.value * cool + self.hvac_p_h.value * heat + self.wh_p.value * wh)
+        p_grid = p_load
+        if 'battery' in self.type:
+            p_grid = p_grid + self.sub_subhourly_steps * (self.p_batt_ch.value + self.p_batt_disch.value)
+        if 'pv' in self.type:
+            p_grid = p_grid - self.sub_subhourly_steps * self.p_pv.value
+
+        self.temp_in_ev.value = temp_in
+        self.temp_wh_ev.value = temp_wh
+        self.temp_in.value = temp_in[1:2]
+        self.temp_wh.value = np.array([self.temp_wh_init.value + k_wh * ((temp_in[1] - self.temp_wh_init.value) / self.wh_r.value + wh[0] * self.wh_p.value)])
+        self.p_load.value = p_load
+        self.p_grid.value = p_grid
+        self.cost.value = np.asarray(self.total_price.value, dtype=float) * p_grid
+
+        tol = 1e-6
+        return bool(np.all(temp_in[1:] >= self.temp_in_min.value - tol) and np.all(temp_in[1:] <= self.temp_in_max.value + tol)
+                    and np.all(temp_wh >= self.temp_wh_min.value - tol) and np.all(temp_wh <= self.temp_wh_max.value + tol)
+                    and self.temp_wh_min.value - tol <= self.temp_wh.value[0] <= self.temp_wh_max.value + tol)
+
+    def repair_relaxed_solution(self, duty_cycles):
+        """
+        Repairs the fractional duty cycles of a solution of the LP relaxation to
+        integer duty cycles. Steps forward through the horizon and picks at each
+        step the integer duty cycles which keep the temperatures within bounds,
+        closest to the relaxed duty cycles plus the rounding error carried over
+        from the previous steps.
+        params
+        duty_cycles: dict, fractional hvac_cool_on, hvac_heat_on and wh_heat_on
+        :return: bool, True if all temperatures are within bounds
+        """
+        k_in = 3600 / (self.home_c.value * self.dt)
+        k_wh = 3600 / (self.wh_c.value * self.dt)
+        oat = np.asarray(self.oat_forecast.value, dtype=float)
+        rem = np.asarray(self.remainder_frac.value, dtype=float)
+        draw = np.asarray(self.draw_frac.value, dtype=float)
+        temp_in_min, temp_in_max = self.temp_in_min.value, self.temp_in_max.value
+        temp_wh_min, temp_wh_max = self.temp_wh_min.value, self.temp_wh_max.value
+        tol = 1e-6
+
+        def violation(temp, lb, ub):
+            v = max(lb - temp, temp - ub, 0)
+            return v if v > tol else 0
+
+        targets = {k: np.clip(np.nan_to_num(np.asarray(v, dtype=float)), 0, None) for k, v in duty_cycles.items()}
+        hvac_options = [(c, h) for c in range(int(self.hvac_cool_max) + 1) for h in range(int(self.hvac_heat_max) + 1)]
+        wh_options = range(int(self.wh_heat_max) + 1)
+        carry = {k: 0 for k in targets}
+        repaired = {k: np.zeros(self.horizon) for k in targets}
+        temp_in = float(self.temp_in_init.value)
+        temp_wh = float(self.temp_wh_init.value)
+        for t in range(self.horizon):
+            goal = {k: targets[k][t] + carry[k] for k in targets}
+            def hvac_rank(option):
+                c, h = option
+                t_in = temp_in + k_in * ((oat[t+1] - temp_in) / self.home_r.value - c * self.hvac_p_c.value + h * self.hvac_p_h.value)
+                return (violation(t_in, temp_in_min, temp_in_max), abs(c - goal["hvac_cool_on"]) + abs(h - goal["hvac_heat_on"]))
+            cool, heat = min(hvac_options, key=hvac_rank)
+            next_temp_in = temp_in + k_in * ((oat[t+1] - temp_in) / self.home_r.value - cool * self.hvac_p_c.value + heat * self.hvac_p_h.value)
+
+            temp_wh_mix = rem[t+1] * temp_wh + draw[t+1] * self.tap_temp
+            def wh_rank(w):
+                t_wh = temp_wh_mix + k_wh * ((next_temp_in - temp_wh_mix) / self.wh_r.value + w * self.wh_p.value)
+                v = violation(t_wh, temp_wh_min, temp_wh_max)
+                if t == 0: # first step without the water draw (MPCCalc.temp_wh)
+                    v = max(v, violation(temp_wh + k_wh * ((next_temp_in - temp_wh) / self.wh_r.value + w * self.wh_p.value), temp_wh_min, temp_wh_max))
+                return (v, abs(w - goal["wh_heat_on"]))
+            wh = min(wh_options, key=wh_rank)
+
+            for k, v in zip(["hvac_cool_on", "hvac_heat_on", "wh_heat_on"], [cool, heat, wh]):
+                repaired[k][t] = v
+                carry[k] = np.clip(goal[k] - v, -1, 1)
+            temp_in = next_temp_in
+            temp_wh = temp_wh_mix + k_wh * ((next_temp_in - temp_wh_mix) / self.wh_r.value + wh * self.wh_p.value)
+
+        self.hvac_cool_on.value = repaired["hvac_cool_on"]
+        self.hvac_heat_on.value = repaired["hvac_heat_on"]
+        self.wh_heat_on.value = repaired["wh_heat_on"]
+        return self.simulate_plan()
+
+    def check_relaxed_gap(self):
+        """
+        Solves the exact MILP for a sampled subset of relaxed homes and records
+        the relative gap between the objective of the repaired relaxed solution
+        and the MILP objective (nan if the home is not sampled or either solve
+        failed).
+        :return: None
+        """
+        self.optimal_vals["relaxed_gap"] = np.nan
+        if not (self.gap_check and self.status in cp.settings.SOLUTION_PRESENT):
+            return
+        repaired = float(np.sum(np.power(self.discount, np.arange(self.horizon)) * self.cost.value))
+        exact = SparseMILP(self)
+        exact.solve(options=self.solver_options("SCIPY_MILP"), set_values=False)
+        if exact.status in cp.settings.SOLUTION_PRESENT:
+            self.optimal_vals["relaxed_gap"] = (repaired - exact.objective) / max(abs(exact.objective), 1e-9)
 
     def implement_presolve(self):
         constraints = [
@@ -483,7 +952,7 @@ class MPCCalc:
 
         i = 0
         while i < 1:
-            if self.prob.status == 'optimal': # if the problem has been solved
+            if self.status in cp.settings.SOLUTION_PRESENT: # if the problem has been solved
                 self.counter = 0
                 self.timestep += 1
                 self.stored_optimal_vals = defaultdict()
@@ -516,85 +985,70 @@ class MPCCalc:
                         self.optimal_vals[k] = self.stored_optimal_vals[k][0]
                     else:
                         self.optimal_vals[k] = self.stored_optimal_vals[k][0]
-                    for j in range(self.horizon):
-                        self.optimal_vals[f"{k}_{j}"] = self.stored_optimal_vals[k][j]
+                    if self.plan_encoding == "text":
+                        for j in range(self.horizon):
+                            self.optimal_vals[f"{k}_{j}"] = self.stored_optimal_vals[k][j]
+                    else:
+                        self.plans[k] = self.stored_optimal_vals[k][:self.horizon]
                 self.optimal_vals["temp_wh_opt"] = self.stored_optimal_vals["temp_wh_opt"][0]
                 self.optimal_vals["temp_in_opt"] = self.stored_optimal_vals["temp_in_opt"][0]
                 self.optimal_vals["correct_solve"] = 1
                 self.optimal_vals["solve_counter"] = 0
-                self.log.debug(f"MPC solved with status {self.prob.status} for {self.name}")
+                self.optimal_vals["solve_tier"] = self.tier
+                self.log.debug(f"MPC solved with status {self.status} for {self.name}")
                 return
             else:
                 # self.implement_presolve()
-                self.counter += 1
-                self.log.warning(f"Unable to solve for house {self.name}. Reverting to optimal solution from last feasible timestep, t-{self.counter}.")
-                self.optimal_vals["correct_solve"] = 0
-
-                if self.counter < self.horizon and self.timestep > 0:
-                    for k in opt_keys:
-                        self.optimal_vals[k] = self.prev_optimal_vals[f"{k}_{self.counter}"]
-
-                    self.presolve_wh_heat_on = float(self.optimal_vals["wh_heat_on_opt"][0])
-                    self.presolve_hvac_cool_on = float(self.optimal_vals["hvac_cool_on_opt"][0])
-                    self.presolve_hvac_heat_on = float(self.optimal_vals["hvac_heat_on_opt"][0])
-
-                    new_temp_in = float(self.temp_in_init.value
-                                        + 3600 * ((((self.oat_current[1] - self.temp_in_init.value) / self.home_r.value))
-                                        - self.presolve_hvac_cool_on * self.hvac_p_c.value
-                                        + self.presolve_hvac_heat_on * self.hvac_p_h.value) / (self.home_c.value * self.dt))
-                    new_temp_wh = float(self.temp_wh_init.value
-                                        + 3600 * ((((new_temp_in - self.temp_wh_init.value) / self.wh_r.value))
-                                        + self.presolve_wh_heat_on * self.wh_p.value) / (self.wh_c.value * self.dt))
-
-                    if new_temp_in > self.temp_in_max.value:
-                        self.presolve_hvac_heat_on = self.hvac_heat_min
-                        self.presolve_hvac_cool_on = self.hvac_cool_max
-                    elif new_temp_in < self.temp_in_min.value:
-                        self.presolve_hvac_heat_on = self.hvac_heat_max
-                        self.presolve_hvac_cool_on = self.hvac_cool_min
-
-                    if new_temp_wh < self.temp_wh_min.value:
-                        self.presolve_wh_heat_on = self.wh_heat_max
-
+                plan = None
+                if self.rule_based: # rule based HEMS, no solver was run
+                    self.optimal_vals["correct_solve"] = 1
                 else:
-                    self.counter = int(np.clip(self.counter, self.horizon, None))
-                    if self.temp_in_init.value > self.temp_in_max.value:
-                        self.presolve_hvac_heat_on = self.hvac_heat_min
-                        self.presolve_hvac_cool_on = self.hvac_cool_max
-                    elif self.temp_in_init.value < self.temp_in_min.value:
-                        self.presolve_hvac_heat_on = self.hvac_heat_max
-                        self.presolve_hvac_cool_on = self.hvac_cool_min
+                    self.counter += 1
+                    self.log.warning(f"Unable to solve for house {self.name}. Reverting to optimal solution from last feasible timestep, t-{self.counter}.")
+                    self.optimal_vals["correct_solve"] = 0
+
+                    if self.counter < self.horizon and self.timestep > 0:
+                        for k in opt_keys:
+                            self.optimal_vals[k] = float(self.prev_plan(k)[self.counter])
+                        plan = {k: self.optimal_vals[f"{k}_opt"] for k in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]}
                     else:
-                        self.presolve_hvac_heat_on = self.hvac_heat_min
-                        self.presolve_hvac_cool_on = self.hvac_cool_min
+                        self.counter = int(np.clip(self.counter, self.horizon, None))
 
-                    if self.temp_wh_init.value < self.temp_wh_min.value:
-                        self.presolve_wh_heat_on = self.wh_heat_max
-                    else:
-                        self.presolve_wh_heat_on = self.wh_heat_min
-
-                new_temp_in = float(self.temp_in_init.value
-                                    + 3600 * ((((self.oat_current[1] - self.temp_in_init.value) / self.home_r.value))
-                                    - self.presolve_hvac_cool_on * self.hvac_p_c.value
-                                    + self.presolve_hvac_heat_on * self.hvac_p_h.value) / (self.home_c.value * self.dt))
-                new_temp_wh = float(self.temp_wh_init.value
-                                    + 3600 * (((new_temp_in - self.temp_wh_init.value) / self.wh_r.value)
-                                    + (self.presolve_wh_heat_on * self.wh_p.value)) / (self.wh_c.value * self.dt))
-
-                self.optimal_vals["wh_heat_on_opt"] = self.presolve_wh_heat_on / self.sub_subhourly_steps
-                self.optimal_vals["hvac_heat_on_opt"] = self.presolve_hvac_heat_on / self.sub_subhourly_steps
-                self.optimal_vals["hvac_cool_on_opt"] = self.presolve_hvac_cool_on / self.sub_subhourly_steps
-                self.optimal_vals["temp_in_opt"] = new_temp_in
-                self.optimal_vals["temp_wh_opt"] = new_temp_wh
-                self.optimal_vals["solve_counter"] = self.counter
-                self.optimal_vals["p_load_opt"] = self.presolve_wh_heat_on * self.wh_p.value + self.presolve_hvac_cool_on * self.hvac_p_c.value + self.presolve_hvac_heat_on * self.hvac_p_h.value
-                self.optimal_vals["forecast_p_grid_opt"] = self.optimal_vals["p_load_opt"]
-                self.optimal_vals["waterdraws"] = self.draw_size[0]
-                self.optimal_vals["p_grid_opt"] = self.optimal_vals["p_load_opt"]
-                self.optimal_vals["cost_opt"] = self.optimal_vals["p_grid_opt"] * self.total_price.value[0]
+                if self.rule_based_vals is None: # not yet set for the whole batch
+                    RuleBasedController([self], [plan]).solve()
+                self.set_rule_based_vals()
                 i+=1
                 pass
 
+    def set_rule_based_vals(self):
+        """
+        Collects the controls of the rule based controller (RuleBasedController)
+        for the current timestep.
+        :return: None
+        """
+        vals = self.rule_based_vals
+        self.rule_based_vals = None
+        self.presolve_wh_heat_on = vals["wh_heat_on"]
+        self.presolve_hvac_cool_on = vals["hvac_cool_on"]
+        self.presolve_hvac_heat_on = vals["hvac_heat_on"]
+
+        self.optimal_vals["wh_heat_on_opt"] = self.presolve_wh_heat_on / self.sub_subhourly_steps
+        self.optimal_vals["hvac_heat_on_opt"] = self.presolve_hvac_heat_on / self.sub_subhourly_steps
+        self.optimal_vals["hvac_cool_on_opt"] = self.presolve_hvac_cool_on / self.sub_subhourly_steps
+        self.optimal_vals["temp_in_opt"] = vals["temp_in"]
+        self.optimal_vals["temp_wh_opt"] = vals["temp_wh"]
+        self.optimal_vals["solve_counter"] = self.counter
+        self.optimal_vals["solve_tier"] = self.tier
+        self.optimal_vals["p_load_opt"] = vals["p_load"]
+        self.optimal_vals["forecast_p_grid_opt"] = self.optimal_vals["p_load_opt"]
+        self.optimal_vals["waterdraws"] = self.draw_size[0]
+        self.optimal_vals["p_grid_opt"] = self.optimal_vals["p_load_opt"]
+        self.optimal_vals["cost_opt"] = self.optimal_vals["p_grid_opt"] * self.sub_subhourly_steps * self.total_price.value[0]
+        if 'battery' in self.type: # battery idles, its state carries over to the next timestep
+            self.optimal_vals["p_batt_ch"] = 0
+            self.optimal_vals["p_batt_disch"] = 0
+            self.optimal_vals["e_batt_opt"] = float(self.e_batt_init.value)
+
     def add_type_constraints(self):
         self.add_base_constraints()
         if 'pv' in self.type:
@@ -618,7 +1072,7 @@ class MPCCalc:
         the base price set by the utility.
         :return: None
         """
-        self.current_values = self.redis_client.conn.hgetall("current_values")
+        self.current_values = self.redis_client.conn.hgetall(self.redis_client.key("current_values"))
 
     def cast_redis_timestep(self):
         """
@@ -632,41 +1086,122 @@ class MPCCalc:
         Casts the reward price signal values for the current timestep.
         :return: None
         """
-        rp = self.redis_client.conn.lrange('reward_price', 0, -1)
+        if self.received_reward_price is not None:
+            rp = self.received_reward_price
+        else:
+            rp = self.redis_client.conn.lrange(self.redis_client.key('reward_price'), 0, -1)
         self.reward_price = rp[:self.horizon]
         self.log.info(f"ts: {self.timestep}; RP: {self.reward_price[0]}")
 
+    def setup_type_problem(self):
+        """
+        Selects routine for MPC optimization problem setup using home type. A
+        parametrized problem is only updated with the current values.
+        :return: None
+        """
+        self.set_environmental_variables()
+        if not self.parametrized:
+            self.prob = None
+            if not (self.sparse or self.dp or self.rule_based):
+                self.setup_cvxpy_problem()
+
     def solve_type_problem(self):
         """
         Selects routine for MPC optimization problem setup and solve using home type.
         :return: None
         """
-        self.set_environmental_variables()
-        self.add_type_constraints()
-        self.set_type_p_grid()
+        self.setup_type_problem()
         self.solve_mpc()
 
-    def run_home(self):
+    def connect_redis(self):
         """
-        Intended for parallelization in parent class (e.g. aggregator); runs a
-        single MPCCalc home.
+        Uses the redis client of the current process with the run ID of the home.
+        :return: None
+        """
+        self.redis_client = RedisClient()
+        if self.redis_client.run_id != self.run_id: # e.g. a worker process of an earlier run
+            self.redis_client.set_run_id(self.run_id)
+
+    def setup_home(self, timestep=None, reward_price=None):
+        """
+        Collects the current timestep and initial conditions of the home from
+        redis and sets up its MPC problem for the timestep (without solving).
+        params
+        timestep: int, current timestep if passed by the caller (e.g. HomeActors) instead of read from redis
+        reward_price: list, reward price over the horizon if passed by the caller instead of read from redis
         :return: None
         """
-        fh = logging.FileHandler(os.path.join("home_logs", f"{self.name}.log"))
-        fh.setLevel(logging.WARN)
+        self.fh = logging.FileHandler(os.path.join("home_logs", f"{self.name}.log"))
+        self.fh.setLevel(logging.WARN)
 
-        self.log = pathos.logger(level=logging.INFO, handler=fh, name=self.name)
+        self.log = pathos.logger(level=logging.INFO, handler=self.fh, name=self.name)
 
-        self.redis_client = RedisClient()
-        self.redis_get_initial_values()
-        self.cast_redis_timestep()
+        self.connect_redis()
+        start_round_trips = self.redis_client.round_trips
+        if timestep is None:
+            self.redis_get_initial_values()
+            self.cast_redis_timestep()
+        else:
+            self.timestep = timestep
+        self.sim_timestep = self.timestep # timestep being solved (self.timestep is advanced by a successful solve)
+        self.received_reward_price = reward_price
 
         if self.timestep > 0:
             self.redis_get_prev_optimal_vals()
 
         self.get_initial_conditions()
-        self.solve_type_problem()
+        self.setup_type_problem()
+        self.set_warm_start()
+        self.round_trips = self.redis_client.round_trips - start_round_trips
+
+    def finish_home(self):
+        """
+        Collects the solution of the MPC problem (or the fallback values) and
+        writes the results for the timestep to redis.
+        :return: bool, False if the results were not written (claimed by the late fallback)
+        """
+        if self.relaxed:
+            self.check_relaxed_gap()
         self.cleanup_and_finish()
-        self.redis_write_optimal_vals()
+        written = self.redis_write_optimal_vals()
+
+        self.log.removeHandler(self.fh)
+        self.fh.close()
+        self.fh = None
+        return written
 
-        self.log.removeHandler(fh)
+    def run_late_fallback(self, timestep, reward_price):
+        """
+        Writes the rule-based fallback of cleanup_and_finish as the results of
+        the timestep for a home which missed the deadline, flagged as late. The
+        home's own solve is not waited for; its results are discarded when it
+        finishes (or it is skipped if it has not started yet).
+        :return: bool, False if the home finished in the meantime and its own results were kept
+        """
+        self.setup_home(timestep, reward_price)
+        self.status = "late"
+        self.tier = len(self.solver_tiers)
+        self.claim_results = True
+        self.late = 1
+        written = self.finish_home()
+        self.late = 0
+        return written
+
+    def run_home(self, timestep=None, reward_price=None, claim_results=False):
+        """
+        Intended for parallelization in parent class (e.g. aggregator); runs a
+        single MPCCalc home.
+        params
+        timestep: int, current timestep if passed by the caller instead of read from redis
+        reward_price: list, reward price over the horizon if passed by the caller instead of read from redis
+        claim_results: bool, only write the results if the aggregator has not written the late fallback for the home
+        :return: None
+        """
+        self.claim_results = claim_results
+        if claim_results:
+            self.connect_redis()
+            if self.redis_client.conn.hexists(self.claims_key(timestep), self.name): # late, not started before the deadline
+                return
+        self.setup_home(timestep, reward_price)
+        self.solve_mpc()
+        self.finish_home()
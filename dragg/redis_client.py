@@ -1,5 +1,10 @@
 import os
+import re
+import time
 import redis
+import numpy as np
+
+from dragg.local_store import LocalStore
 
 class Singleton(type):
 
@@ -10,16 +15,325 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__()
         return cls._instances[cls]
 
+def encode_plan(values, dtype="float64"):
+    """
+    Packs a plan vector into a blob of float32 or float64 values.
+    :return: bytes
+    """
+    return np.asarray(values, dtype=dtype).tobytes()
+
+def decode_plan(blob, dtype="float64"):
+    """
+    Unpacks a blob written by encode_plan (zero-copy, read-only).
+    :return: np.array
+    """
+    return np.frombuffer(blob, dtype=dtype)
+
+def plan_key(key):
+    """
+    Key of the hash holding the packed plans of the hash key.
+    :return: str
+    """
+    return f"{key}:plan"
+
+def connection_pool(decode_responses=True):
+    """
+    Connection pool to the redis server set by the environment: REDIS_URL
+    (e.g. redis://host:6379/0 or unix:///path/redis.sock?db=0), else
+    REDIS_SOCKET (path of a unix domain socket, lower latency than TCP on the
+    same node), else REDIS_HOST. REDIS_MAX_CONNECTIONS limits the size of the pool.
+    :return: redis.ConnectionPool
+    """
+    kwargs = {"decode_responses": decode_responses}
+    if os.environ.get('REDIS_MAX_CONNECTIONS'):
+        kwargs["max_connections"] = int(os.environ['REDIS_MAX_CONNECTIONS'])
+    if os.environ.get('REDIS_URL'):
+        return redis.ConnectionPool.from_url(os.environ['REDIS_URL'], **kwargs)
+    if os.environ.get('REDIS_SOCKET'):
+        return redis.ConnectionPool(connection_class = redis.UnixDomainSocketConnection, path = os.environ['REDIS_SOCKET'], db = 0, **kwargs)
+    return redis.ConnectionPool(host = os.environ.get('REDIS_HOST', 'localhost'), db = 0, **kwargs)
+
+class CountingPipeline(redis.client.Pipeline):
+    """
+    Pipeline which counts one round-trip to the redis server per execute.
+    """
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            CountingRedis.count(time.perf_counter() - start)
+
+class CountingRedis(redis.Redis):
+    """
+    Redis connection which counts its round-trips to the redis server (one per
+    command, one per executed pipeline) and their latency for all connections
+    of the process.
+    """
+    round_trips = 0
+    latency = 0.0 # s, total over the round-trips
+    max_latency = 0.0 # s
+
+    @classmethod
+    def count(cls, latency):
+        cls.round_trips += 1
+        cls.latency += latency
+        cls.max_latency = max(cls.max_latency, latency)
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            CountingRedis.count(time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 class RedisClient(metaclass=Singleton):
 
     def __init__(self):
-        self.pool = redis.ConnectionPool(host = os.environ.get('REDIS_HOST', 'localhost'), decode_responses = True, db = 0)
+        self.transport = 'redis' # One of: 'redis', 'local', set by the aggregator
+        self.run_id = '' # prefix of all keys of the simulation, set by the aggregator
+        self.setup_pools()
+
+    def setup_pools(self):
+        """
+        Creates the connection pools of the current process. Pools (and their
+        connections) are never shared with forked processes, see check_pid.
+        :return: None
+        """
+        self.pid = os.getpid()
+        self.pool = connection_pool(decode_responses = True)
+        # responses are not decoded, for binary values (packed plans)
+        self.raw_pool = connection_pool(decode_responses = False)
+        for k in ['_conn', '_raw_conn']:
+            if hasattr(self, k) and self.transport == 'redis':
+                delattr(self, k)
+
+    def check_pid(self):
+        """
+        Rebuilds the connection pools if the client was inherited by a forked
+        process (e.g. a pool worker or actor).
+        :return: None
+        """
+        if self.pid != os.getpid():
+            CountingRedis.round_trips = 0 # statistics of this process only
+            CountingRedis.latency = 0.0
+            CountingRedis.max_latency = 0.0
+            self.setup_pools()
+
+    def stats(self):
+        """
+        Connection statistics of the process: round-trips, their latency and the
+        size of the connection pools.
+        :return: dict
+        """
+        n = CountingRedis.round_trips
+        stats = {
+            "pid": os.getpid(),
+            "round_trips": n,
+            "latency_total": CountingRedis.latency,
+            "latency_mean": CountingRedis.latency / n if n else 0.0,
+            "latency_max": CountingRedis.max_latency
+        }
+        for name, pool in [("pool", self.pool), ("raw_pool", self.raw_pool)]:
+            stats[f"{name}_connections"] = pool._created_connections
+            stats[f"{name}_in_use"] = len(pool._in_use_connections)
+            stats[f"{name}_max_connections"] = pool.max_connections
+        return stats
+
+    def set_transport(self, transport):
+        """
+        Selects the transport of the process: 'redis' (default, the redis server,
+        for homes running in other processes or nodes) or 'local' (LocalStore,
+        in-process, for homes running in the same process).
+        :return: None
+        """
+        if transport not in ('redis', 'local'):
+            raise ValueError(f"Unknown transport: {transport}")
+        if transport != self.transport:
+            self.transport = transport
+            for k in ['_conn', '_raw_conn']:
+                if hasattr(self, k):
+                    delattr(self, k)
+
+    def set_run_id(self, run_id):
+        """
+        Sets the run ID which prefixes all keys of the simulation.
+        :return: None
+        """
+        if not re.fullmatch(r"[A-Za-z0-9_.-]+", run_id):
+            raise ValueError(f"Invalid run ID: {run_id}")
+        self.run_id = run_id
+
+    def key(self, name):
+        """
+        Key of name in the namespace of the run.
+        :return: str
+        """
+        return f"{self.run_id}:{name}" if self.run_id else name
+
+    def delete_run_keys(self):
+        """
+        Deletes all keys of the run (all keys of the server without a run ID).
+        :return: None
+        """
+        if not self.run_id:
+            self.conn.flushall()
+            return
+        keys = list(self.conn.scan_iter(match=f"{self.run_id}:*", count=1000))
+        for i in range(0, len(keys), 1000):
+            self.conn.delete(*keys[i:i + 1000])
 
     @property
     def conn(self):
+        self.check_pid()
         if not hasattr(self, '_conn'):
             self.getConnection()
         return self._conn
 
+    @property
+    def raw_conn(self):
+        self.check_pid()
+        if not hasattr(self, '_raw_conn'):
+            if self.transport == 'local':
+                self._raw_conn = self.conn
+            else:
+                self._raw_conn = CountingRedis(connection_pool = self.raw_pool)
+        return self._raw_conn
+
+    def write_plans(self, key, plans, dtype="float64", mapping=None, totals=None):
+        """
+        Writes each plan vector as one packed blob per field of the hash
+        plan_key(key), together with the fields of mapping in the hash key, in
+        one round-trip.
+        params
+        plans: dict of plan vectors
+        dtype: str, float32 or float64
+        mapping: dict of values written to the hash key
+        totals: tuple (key, dict of float), values added to the fields of the accumulator hash key (see add_totals)
+        :return: None
+        """
+        pipe = self.raw_conn.pipeline(transaction=False)
+        if mapping:
+            pipe.hset(key, mapping=mapping)
+        if plans:
+            pipe.hset(plan_key(key), mapping={k: self.encode_plan(v, dtype) for k, v in plans.items()})
+        if totals:
+            self.add_totals(pipe, *totals)
+        pipe.execute()
+
+    def add_totals(self, conn, key, values):
+        """
+        Adds values to the fields of the accumulator hash key with atomic
+        server-side increments, so that concurrent writers (e.g. all homes of a
+        timestep) build the totals without reading them back.
+        params
+        conn: connection or pipeline
+        values: dict of float
+        :return: None
+        """
+        for k, v in values.items():
+            conn.hincrbyfloat(key, k, float(v))
+
+    def read_totals(self, key, delete=True):
+        """
+        Reads the accumulator hash key written by add_totals (and deletes it) in
+        one round-trip.
+        :return: dict of float
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.hgetall(key)
+        if delete:
+            pipe.delete(key)
+        totals = pipe.execute()[0]
+        return {k: float(v) for k, v in totals.items()}
+
+    def read_plans(self, key, dtype="float64"):
+        """
+        Reads the hash key and the plan vectors written by write_plans in one
+        round-trip.
+        :return: tuple of dict, the (decoded) fields of the hash key and the plan vectors as np.array
+        """
+        pipe = self.raw_conn.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.hgetall(plan_key(key))
+        vals, blobs = pipe.execute()
+        if self.transport == 'local':
+            return vals, blobs
+        vals = {k.decode(): v.decode() for k, v in vals.items()}
+        plans = {k.decode(): decode_plan(v, dtype) for k, v in blobs.items()}
+        return vals, plans
+
+    def snapshot_hashes(self, keys, suffix="snapshot"):
+        """
+        Copies the hashes keys and their plan vectors on the server (COPY, in
+        one round-trip and without transferring the values), so that they can
+        be read later with dump_hashes while the keys are overwritten, e.g. by
+        a background thread.
+        :return: list of str, the keys of the copies
+        """
+        snapshots = [f"{key}:{suffix}" for key in keys]
+        pipe = self.raw_conn.pipeline(transaction=False)
+        for key, snapshot in zip(keys, snapshots):
+            pipe.copy(key, snapshot, replace=True)
+            pipe.copy(plan_key(key), plan_key(snapshot), replace=True)
+        pipe.execute()
+        return snapshots
+
+    def dump_hashes(self, keys, dtype="float64", delete=False):
+        """
+        Reads the hashes keys and their plan vectors (see write_plans) in one
+        round-trip, e.g. to checkpoint the state of the homes.
+        params
+        delete: bool, delete the hashes after reading them (e.g. the copies of snapshot_hashes)
+        :return: list of tuples of dict, the fields of each hash and its plan vectors as lists
+        """
+        pipe = self.raw_conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+            pipe.hgetall(plan_key(key))
+        if delete:
+            pipe.delete(*keys, *[plan_key(key) for key in keys])
+        res = pipe.execute()[:2 * len(keys)]
+        if self.transport == 'local':
+            return [(vals, {k: np.asarray(v).tolist() for k, v in plans.items()}) for vals, plans in zip(res[::2], res[1::2])]
+        return [({k.decode(): v.decode() for k, v in vals.items()}, {k.decode(): decode_plan(v, dtype).tolist() for k, v in blobs.items()})
+            for vals, blobs in zip(res[::2], res[1::2])]
+
+    def restore_hashes(self, keys, dump, dtype="float64"):
+        """
+        Writes the hashes read by dump_hashes back to the keys in one round-trip.
+        :return: None
+        """
+        pipe = self.raw_conn.pipeline(transaction=False)
+        for key, (vals, plans) in zip(keys, dump):
+            if vals:
+                pipe.hset(key, mapping=vals)
+            if plans:
+                pipe.hset(plan_key(key), mapping={k: self.encode_plan(v, dtype) for k, v in plans.items()})
+        pipe.execute()
+
+    def encode_plan(self, values, dtype="float64"):
+        """
+        Plan vector as stored by the transport: a packed blob (encode_plan) in
+        redis, an array in the LocalStore.
+        """
+        if self.transport == 'local':
+            return np.array(values, dtype=dtype)
+        return encode_plan(values, dtype)
+
+    @property
+    def round_trips(self):
+        """
+        Number of round-trips to the redis server made by this process so far.
+        """
+        self.check_pid()
+        return CountingRedis.round_trips
+
     def getConnection(self):
-        self._conn = redis.Redis(connection_pool = self.pool)
+        if self.transport == 'local':
+            self._conn = LocalStore(count = CountingRedis.count)
+        else:
+            self._conn = CountingRedis(connection_pool = self.pool)
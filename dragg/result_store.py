@@ -0,0 +1,190 @@
+from collections.abc import Mapping
+import numpy as np
+
+class HomeView(Mapping):
+    """
+    Read-only dict-like view of the values of one home in a ResultStore: the
+    constant values (e.g. type) and one np.array per field, over the timesteps
+    collected so far.
+    """
+    def __init__(self, store, h):
+        self.store = store
+        self.h = h
+
+    def __getitem__(self, k):
+        meta = self.store.meta[self.h]
+        if k in meta:
+            return meta[k]
+        if k not in self.store.home_keys[self.h]:
+            raise KeyError(k)
+        return self.store.home_values(self.h, k)
+
+    def __iter__(self):
+        yield from self.store.meta[self.h]
+        yield from self.store.home_keys[self.h]
+
+    def __len__(self):
+        return len(self.store.meta[self.h]) + len(self.store.home_keys[self.h])
+
+class ResultStore(Mapping):
+    def __init__(self, fields, homes, n_timesteps, state_fields=()):
+        """
+        Columnar store of the values collected from the homes, preallocated as
+        float arrays (fields x homes x timesteps). Homes with the same fields
+        (e.g. all base homes) share one array which only holds their fields, so
+        the pv and battery columns are not allocated for homes without them.
+        Behaves like the dict of dicts of lists it replaces: store[name][field]
+        is the array of the home's values so far, and other entries (e.g. the
+        Summary) can be set as in a dict.
+        params
+        fields: List of str, fields of the values appended every timestep (in the order of the columns passed to append)
+        homes: List of dicts with the name, meta (dict of constant values), keys (fields of the home, in order) and
+            initial (dict of the initial values of state fields) of each home
+        n_timesteps: int, number of timesteps of the run
+        state_fields: List of str, fields with an initial value before the first timestep (e.g. temp_in_opt)
+        """
+        self.homes = homes
+        self.state_fields = list(state_fields)
+        self.n_timesteps = n_timesteps
+        self.fields = list(fields)
+        self.field_index = {k: j for j, k in enumerate(self.fields)}
+        self.names = [home["name"] for home in homes]
+        self.home_index = {name: i for i, name in enumerate(self.names)}
+        self.meta = [home["meta"] for home in homes]
+        self.home_keys = [list(home["keys"]) for home in homes]
+        self.offset = np.array([int(k in state_fields) for k in self.fields])
+
+        # one group of homes per set of fields
+        self.groups = [] # dicts: fields (index into self.fields), homes (index of the homes), values (fields x homes x timesteps + 1)
+        self.group = np.zeros(len(homes), dtype=int) # group of each home
+        self.row = np.zeros(len(homes), dtype=int) # index of each home in its group
+        group_of = {}
+        for i, keys in enumerate(self.home_keys):
+            cols = tuple(j for j, k in enumerate(self.fields) if k in keys)
+            if cols not in group_of:
+                group_of[cols] = len(self.groups)
+                self.groups.append({"fields": np.array(cols, dtype=int), "homes": []})
+            g = self.groups[group_of[cols]]
+            self.group[i] = group_of[cols]
+            self.row[i] = len(g["homes"])
+            g["homes"].append(i)
+        for g in self.groups:
+            g["homes"] = np.array(g["homes"], dtype=int)
+            g["index"] = {f: j for j, f in enumerate(g["fields"])}
+            g["values"] = np.full((len(g["fields"]), len(g["homes"]), n_timesteps + 1), np.nan)
+        for i, home in enumerate(homes):
+            g = self.groups[self.group[i]]
+            for k, v in home.get("initial", {}).items():
+                g["values"][g["index"][self.field_index[k]], self.row[i], 0] = v
+        self.counts = np.zeros(len(homes), dtype=int) # timesteps appended per home
+        self.extra = {} # other entries, e.g. the Summary
+
+    def grow(self, n):
+        """
+        Extends the arrays of the groups to at least n columns (more timesteps than preallocated).
+        :return: None
+        """
+        for g in self.groups:
+            while g["values"].shape[2] < n:
+                g["values"] = np.concatenate([g["values"], np.full_like(g["values"], np.nan)], axis=2)
+
+    def append(self, rows, vals):
+        """
+        Appends the values of one timestep.
+        params
+        rows: np.array of int, index of the homes (see home_index)
+        vals: np.array (homes x fields), values in the order of rows and fields
+        :return: None
+        """
+        self.grow(self.counts[rows].max(initial=0) + 2)
+        for gi, g in enumerate(self.groups):
+            sel = np.flatnonzero(self.group[rows] == gi)
+            if len(sel) == 0 or len(g["fields"]) == 0:
+                continue
+            h = rows[sel]
+            offset = self.offset[g["fields"]]
+            for off in np.unique(offset):
+                f = np.flatnonzero(offset == off)
+                g["values"][f[:, None], self.row[h][None, :], (self.counts[h] + off)[None, :]] = vals[sel[:, None], g["fields"][f][None, :]].T
+        self.counts[rows] += 1
+
+    def home_values(self, h, k):
+        """
+        :return: np.array, values of field k of home h so far (view)
+        """
+        j = self.field_index[k]
+        g = self.groups[self.group[h]]
+        return g["values"][g["index"][j], self.row[h], :self.counts[h] + self.offset[j]]
+
+    def field(self, k):
+        """
+        Values of field k of all homes over the timesteps collected so far
+        (nan where a home has no values).
+        :return: np.array (homes x timesteps)
+        """
+        j = self.field_index[k]
+        n = self.counts.max(initial=0)
+        values = np.full((len(self.names), n), np.nan)
+        for g in self.groups:
+            if j in g["index"]:
+                values[g["homes"]] = g["values"][g["index"][j], :, self.offset[j]:n + self.offset[j]]
+        return values
+
+    def timestep_values(self, t0, t1):
+        """
+        Values of timesteps t0 to t1 (excluding t1) of all fields and homes,
+        without the initial values of the state fields (nan for the fields a
+        home does not have).
+        :return: np.array (fields x homes x timesteps)
+        """
+        values = np.full((len(self.fields), len(self.names), t1 - t0), np.nan)
+        for g in self.groups:
+            if len(g["fields"]) == 0:
+                continue
+            cols = np.arange(t0, t1)[None, :] + self.offset[g["fields"]][:, None]
+            values[g["fields"][:, None, None], g["homes"][None, :, None], np.arange(t1 - t0)[None, None, :]] = \
+                g["values"][np.arange(len(g["fields"]))[:, None, None], np.arange(len(g["homes"]))[None, :, None], cols[:, None, :]]
+        return values
+
+    def set_timestep_values(self, t0, vals, counts):
+        """
+        Sets the values of the timesteps from t0 on (inverse of timestep_values).
+        params
+        vals: np.array (fields x homes x timesteps)
+        counts: np.array of int, timesteps appended per home after these values
+        :return: None
+        """
+        t1 = t0 + vals.shape[2]
+        self.grow(t1 + 1)
+        for g in self.groups:
+            if len(g["fields"]) == 0:
+                continue
+            cols = np.arange(t0, t1)[None, :] + self.offset[g["fields"]][:, None]
+            g["values"][np.arange(len(g["fields"]))[:, None, None], np.arange(len(g["homes"]))[None, :, None], cols[:, None, :]] = \
+                vals[g["fields"][:, None, None], g["homes"][None, :, None], np.arange(t1 - t0)[None, None, :]]
+        self.counts = np.array(counts, dtype=int)
+
+    def to_dict(self):
+        """
+        :return: dict of the homes' values as lists (and the other entries), e.g. for the json export
+        """
+        data = {name: {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in self[name].items()} for name in self.names}
+        data.update(self.extra)
+        return data
+
+    def __getitem__(self, k):
+        if k in self.home_index:
+            return HomeView(self, self.home_index[k])
+        return self.extra[k]
+
+    def __setitem__(self, k, v):
+        if k in self.home_index:
+            raise KeyError(f"The values of home {k} cannot be replaced.")
+        self.extra[k] = v
+
+    def __iter__(self):
+        yield from self.names
+        yield from self.extra
+
+    def __len__(self):
+        return len(self.names) + len(self.extra)
@@ -0,0 +1,93 @@
+import numpy as np
+
+class RuleBasedController:
+    def __init__(self, homes, plans=None):
+        """
+        Thermostat control of the HVAC and water heater of many homes at once,
+        vectorized across homes. Serves as the fallback of MPCCalc when no solver
+        finds a solution and as the rule_based HEMS mode.
+        params
+        homes: List of MPCCalc homes with the initial conditions and environmental values of the current timestep
+        plans: List (one entry per home) of dicts with the hvac_cool_on, hvac_heat_on and wh_heat_on duty cycles
+            (fraction of the timestep) planned for the current timestep by an earlier solve, or None for no plan
+        """
+        self.homes = homes
+        self.sub_subhourly_steps = homes[0].sub_subhourly_steps
+        self.collect_states(plans if plans is not None else [None] * len(homes))
+
+    def collect_states(self, plans):
+        """
+        Stacks the parameters, states and bounds of all homes into arrays.
+        :return: None
+        """
+        def stack(f):
+            return np.array([f(home) for home in self.homes], dtype=float)
+
+        self.k_in = stack(lambda h: 3600 / (h.home_c.value * h.dt))
+        self.k_wh = stack(lambda h: 3600 / (h.wh_c.value * h.dt))
+        self.home_r = stack(lambda h: h.home_r.value)
+        self.wh_r = stack(lambda h: h.wh_r.value)
+        self.hvac_p_c = stack(lambda h: h.hvac_p_c.value)
+        self.hvac_p_h = stack(lambda h: h.hvac_p_h.value)
+        self.wh_p = stack(lambda h: h.wh_p.value)
+        self.oat = stack(lambda h: h.oat_current[1])
+        self.temp_in_init = stack(lambda h: h.temp_in_init.value)
+        self.temp_wh_init = stack(lambda h: h.temp_wh_init.value)
+        self.temp_in_min = stack(lambda h: h.temp_in_min.value)
+        self.temp_in_max = stack(lambda h: h.temp_in_max.value)
+        self.temp_wh_min = stack(lambda h: h.temp_wh_min.value)
+        self.hvac_cool_min = stack(lambda h: h.hvac_cool_min)
+        self.hvac_cool_max = stack(lambda h: h.hvac_cool_max)
+        self.hvac_heat_min = stack(lambda h: h.hvac_heat_min)
+        self.hvac_heat_max = stack(lambda h: h.hvac_heat_max)
+        self.wh_heat_min = stack(lambda h: h.wh_heat_min)
+        self.wh_heat_max = stack(lambda h: h.wh_heat_max)
+
+        self.has_plan = np.array([plan is not None for plan in plans])
+        def planned(k):
+            return np.array([float(plan[k]) if plan is not None else 0 for plan in plans]) * self.sub_subhourly_steps
+        self.plan_cool = planned("hvac_cool_on")
+        self.plan_heat = planned("hvac_heat_on")
+        self.plan_wh = planned("wh_heat_on")
+
+    def propagate(self, cool, heat, wh):
+        """
+        Propagates the indoor air and water heater temperatures of all homes
+        over one timestep for the given duty cycles.
+        :return: tuple of np.array, indoor air and water heater temperatures
+        """
+        temp_in = self.temp_in_init + self.k_in * ((self.oat - self.temp_in_init) / self.home_r
+                                                - cool * self.hvac_p_c + heat * self.hvac_p_h)
+        temp_wh = self.temp_wh_init + self.k_wh * ((temp_in - self.temp_wh_init) / self.wh_r + wh * self.wh_p)
+        return temp_in, temp_wh
+
+    def solve(self):
+        """
+        Keeps the planned duty cycles unless they would leave the temperature
+        bounds, homes without a plan switch on HVAC and water heater only when
+        the current temperatures are out of bounds. Writes the controls of
+        each home into home.rule_based_vals.
+        :return: dict of np.array, duty cycles (number of sub-subhourly steps), temperatures and load of all homes
+        """
+        temp_in, temp_wh = self.propagate(self.plan_cool, self.plan_heat, self.plan_wh)
+        temp_in = np.where(self.has_plan, temp_in, self.temp_in_init)
+        temp_wh = np.where(self.has_plan, temp_wh, self.temp_wh_init)
+        too_hot = temp_in > self.temp_in_max
+        too_cold = temp_in < self.temp_in_min
+
+        cool = np.where(too_hot, self.hvac_cool_max, np.where(too_cold, self.hvac_cool_min, np.where(self.has_plan, self.plan_cool, self.hvac_cool_min)))
+        heat = np.where(too_hot, self.hvac_heat_min, np.where(too_cold, self.hvac_heat_max, np.where(self.has_plan, self.plan_heat, self.hvac_heat_min)))
+        wh = np.where(temp_wh < self.temp_wh_min, self.wh_heat_max, np.where(self.has_plan, self.plan_wh, self.wh_heat_min))
+
+        temp_in, temp_wh = self.propagate(cool, heat, wh)
+        vals = {
+            "hvac_cool_on": cool,
+            "hvac_heat_on": heat,
+            "wh_heat_on": wh,
+            "temp_in": temp_in,
+            "temp_wh": temp_wh,
+            "p_load": cool * self.hvac_p_c + heat * self.hvac_p_h + wh * self.wh_p
+        }
+        for i, home in enumerate(self.homes):
+            home.rule_based_vals = {k: float(v[i]) for k, v in vals.items()}
+        return vals
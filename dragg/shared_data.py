@@ -0,0 +1,55 @@
+import os
+import tempfile
+import numpy as np
+
+_attached = {}  # memory maps already attached by this process, by path
+
+def shared_dir():
+    """
+    Directory of the shared files, in memory (/dev/shm) where available.
+    :return: str
+    """
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+def publish_data(df, name):
+    """
+    Writes the columns of a dataframe once as a float64 array (one contiguous
+    row per column) to a memory mapped file which all processes on the node
+    can attach to.
+    params
+    df: pandas.DataFrame with numeric columns
+    name: str, name of the shared file (unique for the run)
+    :return: dict, descriptor of the shared data (path, rows, columns) passed to attach_data
+    """
+    path = os.path.join(shared_dir(), f"{name}.f64")
+    values = df.to_numpy(dtype=np.float64).T
+    data = np.memmap(path, dtype=np.float64, mode="w+", shape=values.shape)
+    data[:] = values
+    data.flush()
+    del data
+    _attached.pop(path, None)
+    return {"path": path, "rows": values.shape[1], "columns": ",".join(df.columns)}
+
+def attach_data(desc):
+    """
+    Attaches read-only to data written by publish_data. Processes attach to
+    each file only once, so homes in the same process share one memory map.
+    params
+    desc: dict, descriptor returned by publish_data
+    :return: dict of np.array, zero-copy column views by column name
+    """
+    path = desc["path"]
+    if path not in _attached:
+        columns = desc["columns"].split(",")
+        data = np.memmap(path, dtype=np.float64, mode="r", shape=(len(columns), int(desc["rows"])))
+        _attached[path] = {c: data[i].view(np.ndarray) for i, c in enumerate(columns)}
+    return _attached[path]
+
+def release_data(desc):
+    """
+    Removes the shared file of the descriptor.
+    :return: None
+    """
+    _attached.pop(desc["path"], None)
+    if os.path.isfile(desc["path"]):
+        os.remove(desc["path"])
@@ -0,0 +1,207 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import milp, Bounds, LinearConstraint
+
+class SparseMILP:
+    def __init__(self, home):
+        """
+        Assembles the MPC problem of an MPCCalc home directly as sparse matrices
+        and solves it with scipy.optimize.milp (HiGHS), bypassing CVXPY.
+        params
+        home: MPCCalc with the initial conditions and environmental values of the current timestep
+        """
+        self.home = home
+        self.horizon = home.horizon
+        self.h_plus = home.h_plus
+        self.battery = 'batt' in home.type
+        self.pv = 'pv' in home.type
+        self.status = None
+        self.objective = None
+        self.set_indices()
+
+    def set_indices(self):
+        """
+        Sets the position of each variable block in the vector of decision variables.
+        :return: None
+        """
+        sizes = [("temp_in_ev", self.h_plus), ("temp_wh_ev", self.h_plus),
+                ("hvac_cool_on", self.horizon), ("hvac_heat_on", self.horizon), ("wh_heat_on", self.horizon)]
+        if self.battery:
+            sizes += [("p_batt_ch", self.horizon), ("p_batt_disch", self.horizon), ("e_batt", self.h_plus)]
+        if self.pv:
+            sizes += [("u_pv_curt", self.horizon)]
+
+        self.idx = {}
+        n = 0
+        for name, size in sizes:
+            self.idx[name] = np.arange(n, n + size)
+            n += size
+        self.n = n
+
+        self.integrality = np.zeros(self.n)
+        for name in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]:
+            self.integrality[self.idx[name]] = 1
+
+    def add_rows(self, rows, cols, vals, lb, ub):
+        """
+        Adds a block of constraint rows lb <= A[rows] x <= ub, rows numbered from 0.
+        :return: None
+        """
+        n_rows = len(lb)
+        self.A_rows.append(np.asarray(rows) + self.m)
+        self.A_cols.append(np.asarray(cols))
+        self.A_vals.append(np.asarray(vals, dtype=float))
+        self.A_lb.append(np.asarray(lb, dtype=float))
+        self.A_ub.append(np.asarray(ub, dtype=float))
+        self.m += n_rows
+
+    def assemble(self):
+        """
+        Assembles the objective, bounds and constraints with the same dynamics as
+        MPCCalc.add_base_constraints, add_battery_constraints, add_pv_constraints
+        and the set_*_p_grid methods.
+        :return: None
+        """
+        home = self.home
+        H = self.horizon
+        t = np.arange(H)
+        sss = home.sub_subhourly_steps
+        self.A_rows, self.A_cols, self.A_vals, self.A_lb, self.A_ub = [], [], [], [], []
+        self.m = 0
+        self.lb = np.full(self.n, -np.inf)
+        self.ub = np.full(self.n, np.inf)
+
+        oat = np.asarray(home.oat_forecast.value, dtype=float)
+        rem = np.asarray(home.remainder_frac.value, dtype=float)
+        draw = np.asarray(home.draw_frac.value, dtype=float)
+        temp_in_init = float(home.temp_in_init.value)
+        temp_wh_init = float(home.temp_wh_init.value)
+        temp_in_min, temp_in_max = float(home.temp_in_min.value), float(home.temp_in_max.value)
+        temp_wh_min, temp_wh_max = float(home.temp_wh_min.value), float(home.temp_wh_max.value)
+        home_r, hvac_p_c, hvac_p_h = float(home.home_r.value), float(home.hvac_p_c.value), float(home.hvac_p_h.value)
+        wh_r, wh_p = float(home.wh_r.value), float(home.wh_p.value)
+        k_in = 3600 / (float(home.home_c.value) * home.dt)
+        k_wh = 3600 / (float(home.wh_c.value) * home.dt)
+
+        T, W = self.idx["temp_in_ev"], self.idx["temp_wh_ev"]
+        C, Ht, WH = self.idx["hvac_cool_on"], self.idx["hvac_heat_on"], self.idx["wh_heat_on"]
+
+        # Indoor air temperature dynamics
+        # T[t+1] - (1 - k/r) T[t] + k p_c C[t] - k p_h H[t] = k oat[t+1] / r
+        self.add_rows(np.repeat(t, 4),
+                    np.column_stack((T[1:], T[:H], C, Ht)).flatten(),
+                    np.tile([1, -(1 - k_in / home_r), k_in * hvac_p_c, -k_in * hvac_p_h], H),
+                    k_in * oat[1:] / home_r, k_in * oat[1:] / home_r)
+
+        # Water heater dynamics, expected value after approx waterdraws
+        # W[t+1] - (1 - k/r) rem[t+1] W[t] - k/r T[t+1] - k p WH[t] = (1 - k/r) draw[t+1] tap
+        mix = (1 - k_wh / wh_r) * draw[1:] * home.tap_temp
+        self.add_rows(np.repeat(t, 4),
+                    np.column_stack((W[1:], W[:H], T[1:], WH)).flatten(),
+                    np.column_stack((np.ones(H), -(1 - k_wh / wh_r) * rem[1:], np.full(H, -k_wh / wh_r), np.full(H, -k_wh * wh_p))).flatten(),
+                    mix, mix)
+
+        # Water heater temperature at the end of the first timestep (MPCCalc.temp_wh)
+        offset = temp_wh_init * (1 - k_wh / wh_r)
+        self.add_rows([0, 0], [T[1], WH[0]], [k_wh / wh_r, k_wh * wh_p],
+                    [temp_wh_min - offset], [temp_wh_max - offset])
+
+        self.lb[T[1:]], self.ub[T[1:]] = temp_in_min, temp_in_max
+        self.lb[W], self.ub[W] = temp_wh_min, temp_wh_max
+        self.lb[T[0]] = self.ub[T[0]] = temp_in_init
+        self.lb[W[0]] = self.ub[W[0]] = temp_wh_init
+        self.lb[C], self.ub[C] = home.hvac_cool_min, home.hvac_cool_max
+        self.lb[Ht], self.ub[Ht] = home.hvac_heat_min, home.hvac_heat_max
+        self.lb[WH], self.ub[WH] = home.wh_heat_min, home.wh_heat_max
+        # the initial water temperature also has to respect the bounds
+        self.feasible = temp_wh_min <= temp_wh_init <= temp_wh_max
+
+        # Objective: discounted cost of p_grid
+        price = np.asarray(home.total_price.value, dtype=float) * np.power(home.discount, t)
+        self.c = np.zeros(self.n)
+        self.c0 = 0 # constant part of the objective
+        self.c[C] = price * sss * hvac_p_c
+        self.c[Ht] = price * sss * hvac_p_h
+        self.c[WH] = price * sss * wh_p
+
+        if self.battery:
+            CH, DIS, E = self.idx["p_batt_ch"], self.idx["p_batt_disch"], self.idx["e_batt"]
+            ch_eff, disch_eff = float(home.batt_ch_eff.value), float(home.batt_disch_eff.value)
+            # E[t+1] - E[t] - ch_eff / dt CH[t] - 1 / (disch_eff dt) DIS[t] = 0
+            self.add_rows(np.repeat(t, 4),
+                        np.column_stack((E[1:], E[:H], CH, DIS)).flatten(),
+                        np.tile([1, -1, -ch_eff / home.dt, -1 / (disch_eff * home.dt)], H),
+                        np.zeros(H), np.zeros(H))
+            max_rate = float(home.batt_max_rate.value)
+            self.lb[CH], self.ub[CH] = 0, max_rate
+            self.lb[DIS], self.ub[DIS] = -max_rate, 0
+            self.lb[E[1:]], self.ub[E[1:]] = float(home.batt_cap_min.value), float(home.batt_cap_max.value)
+            self.lb[E[0]] = self.ub[E[0]] = float(home.e_batt_init.value)
+            self.c[CH] = price * sss
+            self.c[DIS] = price * sss
+
+        if self.pv:
+            U = self.idx["u_pv_curt"]
+            self.pv_max = float(home.pv_area.value) * float(home.pv_eff.value) * np.asarray(home.ghi_forecast.value, dtype=float)[:H] / 1000
+            self.lb[U], self.ub[U] = 0, 1
+            self.c[U] = price * sss * self.pv_max
+            self.c0 = -np.sum(price * sss * self.pv_max)
+
+        self.A = sp.csr_matrix((np.concatenate(self.A_vals), (np.concatenate(self.A_rows), np.concatenate(self.A_cols))), shape=(self.m, self.n))
+        self.b_lb = np.concatenate(self.A_lb)
+        self.b_ub = np.concatenate(self.A_ub)
+
+    def solve(self, options={}, relaxed=False, set_values=True):
+        """
+        Solves the assembled problem with HiGHS and writes the solution into the
+        CVXPY variables of the home, so that MPCCalc.cleanup_and_finish can
+        collect it as for any other solver.
+        params
+        options: dict, options of scipy.optimize.milp (e.g. time_limit, mip_rel_gap)
+        relaxed: bool, solve the LP relaxation (duty cycles are not rounded)
+        set_values: bool, write the solution into the variables of the home (False only records the objective)
+        :return: None
+        """
+        self.assemble()
+        if not self.feasible:
+            self.status = "infeasible"
+            return
+
+        integrality = np.zeros(self.n) if relaxed else self.integrality
+        res = milp(self.c, integrality=integrality, bounds=Bounds(self.lb, self.ub),
+                    constraints=LinearConstraint(self.A, self.b_lb, self.b_ub), options=options)
+        statuses = {0: "optimal", 1: "user_limit", 2: "infeasible", 3: "unbounded"}
+        self.status = statuses.get(res.status, "solver_error")
+        if res.x is None:
+            if self.status == "user_limit": # time limit without a feasible solution
+                self.status = "infeasible_inaccurate"
+            return
+        self.objective = res.fun + self.c0
+        if set_values:
+            self.set_values(res.x, relaxed)
+
+    def set_values(self, x, relaxed=False):
+        """
+        Sets the values of the CVXPY variables of the home from the solution
+        vector. The temperatures, loads and cost follow from the dynamics. The
+        fractional duty cycles of a relaxed solution are kept in duty_cycles to
+        be rounded by the home.
+        :return: None
+        """
+        home = self.home
+        vals = {name: x[i] for name, i in self.idx.items()}
+        self.duty_cycles = {name: vals[name] for name in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]}
+        if not relaxed:
+            home.hvac_cool_on.value = np.round(vals["hvac_cool_on"])
+            home.hvac_heat_on.value = np.round(vals["hvac_heat_on"])
+            home.wh_heat_on.value = np.round(vals["wh_heat_on"])
+
+        if self.battery:
+            home.p_batt_ch.value = vals["p_batt_ch"]
+            home.p_batt_disch.value = vals["p_batt_disch"]
+            home.e_batt.value = vals["e_batt"]
+        if self.pv:
+            home.u_pv_curt.value = vals["u_pv_curt"]
+            home.p_pv.value = self.pv_max * (1 - vals["u_pv_curt"])
+        if not relaxed:
+            home.simulate_plan()
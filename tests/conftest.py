@@ -0,0 +1,101 @@
+import os
+import shutil
+import socket
+
+import pytest
+import toml
+
+REPO_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dragg", "data")
+
+# aggregate load of the small community (see small_config) in the baseline MPC run
+BASELINE_LOADS = [-0.8105531142445203, 3.856113552422147, 7.505491142769369, 7.583333333333334, 7.0, 7.000000000000001]
+
+def small_config():
+    """
+    Config of a community of 4 homes (base, pv_only and battery_only) over 6
+    hours, solved with GLPK_MI.
+    :return: dict
+    """
+    with open(os.path.join(REPO_DATA, "config.toml")) as f:
+        config = toml.load(f)
+    config['community'].update({"total_number_homes": 4, "homes_battery": 1, "homes_pv": 1, "homes_pv_battery": 0})
+    config['simulation'].update({"end_datetime": "2015-01-01 06", "n_nodes": 2, "engine": "batch", "transport": "local",
+        "checkpoint_interval": "hourly", "run_id": ""})
+    config['home']['wh']['waterdraw_file'] = "waterdraw_profiles.csv"
+    config['home']['hems'].update({"time_limit": 5, "mip_gap": 0.0001})
+    return config
+
+def redis_available():
+    try:
+        with socket.create_connection((os.environ.get('REDIS_HOST', 'localhost'), 6379), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+requires_redis = pytest.mark.skipif(not redis_available(), reason="requires a redis server")
+
+@pytest.fixture
+def sim_dir(tmp_path, monkeypatch):
+    """
+    Runs the test in a temporary directory with the data files of the repo
+    and the small config (data/config.toml), returns a function which
+    rewrites the config with the given updates of its sections.
+    """
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "home_logs").mkdir()
+    for file in ["nsrdb.csv", "waterdraw_profiles.csv"]:
+        shutil.copy(os.path.join(REPO_DATA, file), data_dir / file)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATA_DIR", str(data_dir))
+    monkeypatch.delenv("CONFIG_FILE", raising=False)
+
+    def configure(**sections):
+        config = small_config()
+        for section, values in sections.items():
+            node = config
+            for k in section.split("__"):
+                node = node[k]
+            node.update(values)
+        with open(data_dir / "config.toml", "w") as f:
+            toml.dump(config, f)
+        return config
+
+    configure()
+    return configure
+
+@pytest.fixture
+def community(sim_dir):
+    """
+    Returns a function which sets up the homes of a community of 8 base, 2
+    pv_only and 2 battery_only homes for the first timestep (not solved), with
+    the given updates of the config sections (see sim_dir).
+    """
+    aggs = []
+    def setup(**sections):
+        sim_dir(community={"total_number_homes": 12, "homes_battery": 2, "homes_pv": 2, "homes_pv_battery": 0}, **sections)
+        from dragg.aggregator import Aggregator
+        agg = Aggregator()
+        aggs.append(agg)
+        agg.flush_redis()
+        agg.get_homes()
+        for home in agg.all_homes_obj:
+            home.setup_home()
+        return agg.all_homes_obj
+    yield setup
+    for agg in aggs:
+        agg.release_environmental_data()
+        agg.redis_client.delete_run_keys()
+
+def run_simulation():
+    """
+    Runs the simulation of the config written by sim_dir.
+    :return: dict, the results (results.json) of the baseline case
+    """
+    import json
+    import glob
+    from dragg.aggregator import Aggregator
+    Aggregator().run()
+    files = glob.glob(os.path.join("outputs", "**", "baseline", "results.json"), recursive=True)
+    with open(files[0]) as f:
+        return json.load(f)
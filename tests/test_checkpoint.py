@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pytest
+
+from dragg.result_store import ResultStore
+from dragg.checkpoint import CheckpointWriter, CheckpointThread, load_checkpoints, load_state
+from test_result_store import FIELDS, STATE_FIELDS, make_homes, fill
+
+def test_checkpoint_round_trip(tmp_path):
+    store = ResultStore(FIELDS, make_homes(), 6, STATE_FIELDS)
+    writer = CheckpointWriter(str(tmp_path))
+    writer.reset()
+    series = []
+    rng = np.random.default_rng(1)
+    for t in range(6):
+        fill(store, 1, seed=t)
+        series.append(rng.standard_normal())
+        if t % 2 == 1:
+            writer.write(store, t + 1, {"load": series})
+    loaded, loaded_series, manifest = load_checkpoints(str(tmp_path))
+    assert [c["end"] for c in manifest["chunks"]] == [2, 4, 6]
+    assert json.dumps(loaded.to_dict()) == json.dumps(store.to_dict())
+    np.testing.assert_array_equal(loaded_series["load"], series)
+
+def test_checkpoint_thread(tmp_path):
+    store = ResultStore(FIELDS, make_homes(), 4, STATE_FIELDS)
+    writer = CheckpointWriter(str(tmp_path))
+    writer.reset()
+    thread = CheckpointThread(writer, max_pending=1)
+    for t in range(4):
+        fill(store, 1, seed=t)
+        thread.submit(store, t + 1, state=lambda t=t: {"timestep": t + 1})
+    thread.close()
+    thread.check()
+    loaded, _, _ = load_checkpoints(str(tmp_path))
+    assert json.dumps(loaded.to_dict()) == json.dumps(store.to_dict())
+    assert load_state(str(tmp_path)) == {"timestep": 4} # the states are read in the thread
+
+def test_checkpoint_thread_reports_errors(tmp_path):
+    store = ResultStore(FIELDS, make_homes(), 4, STATE_FIELDS)
+    writer = CheckpointWriter(str(tmp_path))
+    thread = CheckpointThread(writer)
+    def fail():
+        raise OSError("disk full")
+    fill(store, 1)
+    thread.submit(store, 1, state=fail)
+    thread.close()
+    with pytest.raises(OSError, match="disk full"):
+        thread.check()
@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+import pytest
+
+from dragg.aggregator import Aggregator
+from dragg.mpc_calc import MPCCalc
+from dragg.redis_client import RedisClient
+from conftest import requires_redis, run_simulation
+
+pytestmark = requires_redis
+
+DEADLINE = 1.0 # s
+
+# the homes are solved by forked worker processes, which inherit the patches of the tests
+simulation = {"engine": "pool", "executor": "process", "transport": "redis", "n_nodes": 3}
+
+def is_battery(home):
+    return home["type"] == "battery_only"
+
+def watch_keys(monkeypatch):
+    """
+    Records the timesteps of the claims hashes and the number of totals
+    hashes left in redis after the data of each timestep is collected.
+    :return: list of tuples (timestep, list of claimed timesteps, number of totals hashes)
+    """
+    seen = []
+    collect_data = Aggregator.collect_data
+    def watch(self):
+        collect_data(self)
+        conn = self.redis_client.conn
+        claims = sorted(int(k.rsplit(":", 1)[1]) for k in conn.scan_iter(match=self.redis_client.key("claims:*")))
+        totals = list(conn.scan_iter(match=self.redis_client.key("totals:*")))
+        seen.append((self.timestep - 1, claims, len(totals)))
+    monkeypatch.setattr(Aggregator, "collect_data", watch)
+    return seen
+
+def check_totals(results):
+    """
+    The aggregate load of each timestep includes every home, late or not.
+    """
+    homes = [v for k, v in results.items() if k != "Summary"]
+    np.testing.assert_allclose(results["Summary"]["p_grid_aggregate"], np.sum([home["p_grid_opt"] for home in homes], axis=0), atol=1e-6)
+
+@pytest.fixture
+def full_run(sim_dir):
+    """
+    Results of the community on the pool engine without deadline.
+    """
+    sim_dir(simulation=simulation)
+    return run_simulation()
+
+def test_late_home_gets_the_fallback(sim_dir, monkeypatch, full_run):
+    solve_mpc = MPCCalc.solve_mpc
+    def slow(self, start_tier=0):
+        if self.type == "battery_only":
+            time.sleep(2 * DEADLINE)
+        solve_mpc(self, start_tier)
+    monkeypatch.setattr(MPCCalc, "solve_mpc", slow)
+    seen = watch_keys(monkeypatch)
+    sim_dir(simulation={**simulation, "deadline": DEADLINE})
+    results = run_simulation()
+
+    assert results["Summary"]["late_homes"] == [1] * 6
+    for name, home in full_run.items():
+        if name == "Summary":
+            continue
+        if is_battery(home):
+            assert results[name]["late"] == [1] * 6
+            assert results[name]["solve_tier"] == [results["Summary"]["solver_tiers"].index("rule_based")] * 6
+        else:
+            assert results[name]["late"] == [0] * 6
+            for k, v in home.items():
+                assert results[name][k] == v # the homes on time are unchanged
+    check_totals(results)
+    for timestep, claims, totals in seen:
+        assert totals == 0 # the discarded solves do not add to the totals
+        assert len(claims) <= 3 and all(t <= timestep for t in claims) # kept only while a late solve may finish
+
+def test_claimed_results_are_waited_for(sim_dir, monkeypatch, full_run):
+    write_plans = RedisClient.write_plans
+    def slow(self, key, plans, dtype="float64", mapping=None, totals=None):
+        if mapping and "e_batt_opt" in mapping and mapping["late"] == 0: # claimed by the home before the deadline
+            time.sleep(2 * DEADLINE)
+        write_plans(self, key, plans, dtype, mapping, totals)
+    monkeypatch.setattr(RedisClient, "write_plans", slow)
+    seen = watch_keys(monkeypatch)
+    sim_dir(simulation={**simulation, "deadline": DEADLINE})
+    results = run_simulation()
+
+    assert results["Summary"]["late_homes"] == [0] * 6
+    assert results["Summary"]["p_grid_aggregate"] == pytest.approx(full_run["Summary"]["p_grid_aggregate"], abs=1e-9)
+    for name, home in full_run.items():
+        if name != "Summary":
+            assert results[name]["late"] == [0] * 6
+            for k, v in home.items():
+                assert results[name][k] == v
+    check_totals(results)
+    for timestep, claims, totals in seen:
+        assert claims == [] and totals == 0
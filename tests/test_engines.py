@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from dragg.aggregator import Aggregator
+from dragg.mpc_calc import MPCCalc
+from dragg.mpc_batch import MPCBatch
+from conftest import BASELINE_LOADS, requires_redis, run_simulation
+
+local_engines = [
+    {"engine": "batch", "transport": "local"},
+    {"engine": "batch", "transport": "local", "batch_size": 2},
+    {"engine": "pool", "executor": "thread", "transport": "local"},
+]
+
+redis_engines = [
+    {"engine": "pool", "executor": "process", "transport": "redis"},
+    {"engine": "pool", "executor": "process", "transport": "redis", "env_data": "redis"},
+    {"engine": "batch", "transport": "redis"},
+    {"engine": "actors", "transport": "redis"},
+]
+
+def check_baseline(results):
+    np.testing.assert_allclose(results["Summary"]["p_grid_aggregate"], BASELINE_LOADS, atol=1e-3)
+    for name, home in results.items():
+        if name != "Summary":
+            assert len(home["p_grid_opt"]) == len(BASELINE_LOADS)
+            assert len(home["temp_in_opt"]) == len(BASELINE_LOADS) + 1
+
+@pytest.mark.parametrize("simulation", local_engines)
+def test_local_engine_matches_baseline(sim_dir, simulation):
+    sim_dir(simulation=simulation)
+    check_baseline(run_simulation())
+
+@requires_redis
+@pytest.mark.parametrize("simulation", redis_engines)
+def test_redis_engine_matches_baseline(sim_dir, simulation):
+    sim_dir(simulation=simulation)
+    check_baseline(run_simulation())
+
+@pytest.mark.parametrize("simulation", [
+    local_engines[0],
+    local_engines[2],
+    pytest.param(redis_engines[0], marks=requires_redis),
+    pytest.param(redis_engines[3], marks=requires_redis),
+])
+def test_parametrized_problems_match_baseline(sim_dir, simulation):
+    sim_dir(simulation=simulation, home__hems={"parametrized": True})
+    check_baseline(run_simulation())
+
+def test_packed_plans_match_baseline(sim_dir):
+    sim_dir(home__hems={"plan_encoding": "float64"})
+    check_baseline(run_simulation())
+
+@requires_redis
+@pytest.mark.parametrize("plan_encoding", ["text", "float64"])
+def test_local_transport_counts_the_redis_round_trips(sim_dir, plan_encoding):
+    round_trips = {}
+    for transport in ["redis", "local"]:
+        # checkpoints written in the loop, the background writer would add its round-trips to a random timestep
+        sim_dir(simulation={"transport": transport, "checkpoint_queue": 0}, home__hems={"plan_encoding": plan_encoding})
+        round_trips[transport] = run_simulation()["Summary"]["redis_round_trips"]
+    assert round_trips["local"] == round_trips["redis"]
+
+@pytest.mark.parametrize("simulation", [local_engines[0], local_engines[2]])
+def test_parametrized_problems_are_built_once(sim_dir, monkeypatch, simulation):
+    built = []
+    setup = MPCCalc.setup_parametrized_problem
+    def spy(self):
+        built.append(self.name)
+        setup(self)
+    monkeypatch.setattr(MPCCalc, "setup_parametrized_problem", spy)
+    sim_dir(simulation=simulation, home__hems={"parametrized": True})
+    results = run_simulation()
+    assert sorted(built) == sorted(name for name in results if name != "Summary") # once per home, not per timestep
+
+@requires_redis
+def test_actors_reply_the_collected_values(sim_dir, monkeypatch):
+    sim_dir(simulation=redis_engines[0])
+    pool = run_simulation()
+    replied = []
+    collect_home_data = Aggregator.collect_home_data
+    def spy(self):
+        replied.append(self.iteration_results is not None)
+        collect_home_data(self)
+    monkeypatch.setattr(Aggregator, "collect_home_data", spy)
+    sim_dir(simulation=redis_engines[3])
+    actors = run_simulation()
+    assert replied == [True] * 6 # not read back from redis
+    for name, home in pool.items():
+        if name != "Summary":
+            assert actors[name] == home # the values replied by the actors are those written to redis
+
+def test_inaccurate_batch_solution_is_kept(sim_dir, monkeypatch):
+    setup_batch_problem = MPCBatch.setup_batch_problem
+    def inaccurate(self):
+        setup_batch_problem(self)
+        solve = self.prob.solve
+        def solve_inaccurate(*args, **kwargs):
+            solve(*args, **kwargs)
+            if self.prob.status == "optimal":
+                self.prob._status = "optimal_inaccurate"
+        self.prob.solve = solve_inaccurate
+    monkeypatch.setattr(MPCBatch, "setup_batch_problem", inaccurate)
+    resolved = []
+    solve_mpc = MPCCalc.solve_mpc
+    def spy(self, start_tier=0):
+        resolved.append(self.name)
+        solve_mpc(self, start_tier)
+    monkeypatch.setattr(MPCCalc, "solve_mpc", spy)
+    sim_dir(home__hems={"mode": "relaxed", "solver": "ECOS"})
+    results = run_simulation()
+    assert results["Summary"]["p_grid_aggregate"] # the stacked problem was solved
+    assert resolved == [] # and its solution used, not solved again home by home
@@ -0,0 +1,39 @@
+import dill
+import numpy as np
+
+def forecasts(homes, timesteps):
+    """
+    OAT forecast errors of each home at the given timesteps.
+    :return: dict of np.array (timesteps x horizon)
+    """
+    return {home.name: np.array([home.oat_noise(t) for t in timesteps]) for home in homes}
+
+def test_same_seed_gives_the_same_noise(community):
+    first = forecasts(community(), range(6))
+    second = forecasts(community(), range(6))
+    assert first.keys() == second.keys()
+    for name in first:
+        np.testing.assert_array_equal(first[name], second[name])
+
+def test_noise_does_not_depend_on_the_order_of_the_timesteps(community):
+    homes = community()
+    in_order = forecasts(homes, range(6))
+    copies = [dill.copy(home) for home in homes] # as sent to the workers by pathos
+    reversed_order = forecasts(copies, range(5, -1, -1))
+    for name in in_order:
+        np.testing.assert_array_equal(in_order[name], reversed_order[name][::-1])
+
+def test_noise_differs_between_homes_timesteps_and_seeds(community):
+    homes = community()
+    noise = forecasts(homes, range(6))
+    values = np.array(list(noise.values())) # homes x timesteps x horizon
+    assert len(np.unique(values[:, 0, 0])) == len(homes)
+    assert len(np.unique(values[0, :, 0])) == 6
+    other = np.array(list(forecasts(community(simulation={"random_seed": 1234}), range(6)).values()))
+    for home, other_home in zip(values, other): # same position in the community, other seed
+        assert not np.allclose(home, other_home)
+
+def test_forecast_of_the_timestep_uses_the_noise(community):
+    homes = community()
+    for home in homes:
+        np.testing.assert_allclose(home.oat_current_ev[1:] - home.oat_current[1:], home.oat_noise(home.timestep), atol=1e-12)
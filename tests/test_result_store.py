@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+
+from dragg.result_store import ResultStore
+
+FIELDS = ["p_grid_opt", "temp_in_opt", "p_pv_opt", "e_batt_opt", "round_trips"]
+STATE_FIELDS = ["temp_in_opt", "e_batt_opt"]
+
+def make_homes():
+    return [
+        {"name": "base-1", "meta": {"type": "base"}, "keys": ["p_grid_opt", "temp_in_opt"], "initial": {"temp_in_opt": 20.0}},
+        {"name": "pv-1", "meta": {"type": "pv_only"}, "keys": ["p_grid_opt", "temp_in_opt", "p_pv_opt"], "initial": {"temp_in_opt": 21.0}},
+        {"name": "base-2", "meta": {"type": "base"}, "keys": ["p_grid_opt", "temp_in_opt"], "initial": {"temp_in_opt": 22.0}},
+        {"name": "batt-1", "meta": {"type": "battery_only"}, "keys": ["p_grid_opt", "temp_in_opt", "e_batt_opt"], "initial": {"temp_in_opt": 23.0, "e_batt_opt": 5.0}},
+    ]
+
+def fill(store, n_timesteps, seed=0):
+    """
+    Appends random values, as collected by the aggregator (homes x all fields),
+    and returns them as the expected lists of each home.
+    """
+    rng = np.random.default_rng(seed)
+    expected = {home["name"]: {k: [home["initial"][k]] if k in home["initial"] else [] for k in home["keys"]} for home in store.homes}
+    for t in range(n_timesteps):
+        rows = np.arange(len(store.names)) if t != 1 else np.array([3, 0]) # homes may be missing from a timestep
+        vals = rng.standard_normal((len(rows), len(FIELDS)))
+        store.append(rows, vals)
+        for r, row in zip(rows, vals):
+            home = store.homes[r]
+            for k in home["keys"]:
+                expected[home["name"]][k].append(row[FIELDS.index(k)])
+    return expected
+
+def test_values_of_each_home():
+    store = ResultStore(FIELDS, make_homes(), 3, STATE_FIELDS)
+    expected = fill(store, 5) # grows past the preallocated timesteps
+    for name, values in expected.items():
+        assert set(store[name]) == {"type"} | set(values)
+        for k, v in values.items():
+            np.testing.assert_array_equal(store[name][k], v)
+    p_pv = store.field("p_pv_opt")
+    assert p_pv.shape == (4, 5)
+    assert np.isnan(p_pv[[0, 2, 3]]).all()
+    # pv-1 is missing from one timestep, its values are padded at the end
+    np.testing.assert_array_equal(p_pv[1, :4], expected["pv-1"]["p_pv_opt"])
+    assert np.isnan(p_pv[1, 4])
+
+def test_fields_are_allocated_per_home_type():
+    store = ResultStore(FIELDS, make_homes(), 10, STATE_FIELDS)
+    allocated = sum(g["values"].size for g in store.groups)
+    # base: 2 fields x 2 homes, pv: 3 fields, battery: 3 fields (round_trips is not a field of any home)
+    assert allocated == (2 * 2 + 3 + 3) * 11
+
+def test_dict_round_trip():
+    store = ResultStore(FIELDS, make_homes(), 3, STATE_FIELDS)
+    expected = fill(store, 4)
+    store["Summary"] = {"case": "baseline"}
+    data = json.loads(json.dumps(store.to_dict()))
+    assert data["Summary"] == {"case": "baseline"}
+    for name, values in expected.items():
+        assert data[name]["type"] == store[name]["type"]
+        for k, v in values.items():
+            np.testing.assert_allclose(data[name][k], v)
+
+def test_timestep_values_round_trip():
+    store = ResultStore(FIELDS, make_homes(), 6, STATE_FIELDS)
+    fill(store, 6)
+    copy = ResultStore(FIELDS, make_homes(), 6, STATE_FIELDS)
+    copy.set_timestep_values(0, store.timestep_values(0, 3), store.counts)
+    copy.set_timestep_values(3, store.timestep_values(3, 6), store.counts)
+    assert json.dumps(copy.to_dict()) == json.dumps(store.to_dict())
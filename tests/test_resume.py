@@ -0,0 +1,58 @@
+import glob
+import os
+
+import pytest
+
+from dragg.aggregator import Aggregator
+from conftest import requires_redis, run_simulation
+
+def crash_after(monkeypatch, timestep):
+    """
+    Makes the simulation fail after collecting the given timestep.
+    """
+    collect_data = Aggregator.collect_data
+    def crash(self):
+        collect_data(self)
+        if self.timestep == timestep:
+            raise RuntimeError("simulated crash")
+    monkeypatch.setattr(Aggregator, "collect_data", crash)
+
+@pytest.mark.parametrize("transport, checkpoint_queue", [
+    ("local", 0),
+    ("local", 2),
+    pytest.param("redis", 2, marks=requires_redis), # snapshots of the redis hashes read by the writer thread
+])
+def test_resume_gives_identical_results(sim_dir, monkeypatch, transport, checkpoint_queue):
+    simulation = {"transport": transport, "checkpoint_queue": checkpoint_queue}
+    sim_dir(simulation=simulation)
+    full = run_simulation()
+    for file in glob.glob(os.path.join("outputs", "**", "results.json"), recursive=True):
+        os.remove(file)
+
+    with monkeypatch.context() as m:
+        crash_after(m, 4)
+        with pytest.raises(RuntimeError, match="simulated crash"):
+            Aggregator().run()
+
+    resumed_from = []
+    resume = Aggregator.resume_from_checkpoint
+    def spy(self):
+        resumed = resume(self)
+        resumed_from.append(self.timestep if resumed else None)
+        return resumed
+    monkeypatch.setattr(Aggregator, "resume_from_checkpoint", spy)
+    sim_dir(simulation={**simulation, "resume": True})
+    resumed = run_simulation()
+
+    assert resumed_from == [3] # the checkpoint of timestep 4 was not written
+    for name, home in full.items():
+        if name == "Summary":
+            for k in ["p_grid_aggregate", "RP", "p_grid_setpoint"]:
+                assert resumed[name][k] == home[k]
+        else:
+            assert resumed[name] == home
+
+def test_resume_without_checkpoint_starts_over(sim_dir):
+    sim_dir(simulation={"resume": True})
+    results = run_simulation()
+    assert len(results["Summary"]["p_grid_aggregate"]) == 6
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+import cvxpy as cp
+
+from dragg.mpc_calc import MPCCalc
+from dragg.sparse_milp import SparseMILP
+from dragg.dp_solver import DPSolver
+
+@pytest.fixture
+def homes(community):
+    return community()
+
+def discounted_cost(home):
+    return float(np.sum(np.power(home.discount, np.arange(home.horizon)) * home.cost.value))
+
+def test_sparse_milp_matches_cvxpy(homes):
+    for home in homes:
+        home.solve_tier(cp.GLPK_MI)
+        assert home.status in cp.settings.SOLUTION_PRESENT # optimal_inaccurate when GLPK stops at mip_gap
+        milp = SparseMILP(home)
+        milp.solve(options=home.solver_options("SCIPY_MILP"), set_values=False)
+        assert milp.status == "optimal"
+        assert milp.objective == pytest.approx(home.prob.value, rel=1e-3, abs=1e-4)
+
+def test_sparse_milp_solution(homes):
+    for home in homes:
+        milp = SparseMILP(home)
+        milp.solve(options=home.solver_options("SCIPY_MILP"))
+        assert milp.status == "optimal"
+        assert home.simulate_plan() # the duty cycles keep the temperatures within bounds
+        assert discounted_cost(home) == pytest.approx(milp.objective, rel=1e-6, abs=1e-6)
+
+# expected gap of the dynamic programming solution (dp_grid_points = 21) to the exact MILP, measured on
+# 30 base homes: 0.5% on average, 9.9% for the worst home, indoor temperatures within 0.71 degC
+DP_COST_GAP = 0.15 # of a home, relative to the MILP objective (or absolute for objectives below 1)
+DP_MEAN_COST_GAP = 0.02 # over the homes
+DP_TEMP_GAP = 1.0 # degC, largest difference of the indoor and water heater temperatures over the horizon
+
+def test_dp_close_to_milp(homes):
+    base = [home for home in homes if home.type == "base"]
+    exact = []
+    for home in base:
+        milp = SparseMILP(home)
+        milp.solve(options=home.solver_options("SCIPY_MILP"))
+        assert milp.status == "optimal"
+        home.simulate_plan()
+        exact.append((milp.objective, home.temp_in_ev.value.copy(), home.temp_wh_ev.value.copy()))
+
+    DPSolver(base, base[0].dp_grid_points, base[0].dp_penalty).solve()
+    gaps = []
+    for home, (objective, temp_in, temp_wh) in zip(base, exact):
+        assert home.status == "optimal" # within the temperature bounds
+        cost = discounted_cost(home)
+        assert cost >= objective - 1e-6 # the MILP is optimal
+        gaps.append((cost - objective) / max(abs(objective), 1))
+        assert gaps[-1] <= DP_COST_GAP
+        assert np.max(np.abs(home.temp_in_ev.value - temp_in)) <= DP_TEMP_GAP
+        assert np.max(np.abs(home.temp_wh_ev.value - temp_wh)) <= DP_TEMP_GAP
+    assert np.mean(gaps) <= DP_MEAN_COST_GAP
+
+FALLBACK_SOLVERS = [cp.GLPK_MI, "SCIPY_MILP", "RELAXED"]
+
+def fail_solvers(monkeypatch, failing):
+    """
+    Makes the solves of the given solver tiers fail and records the tiers
+    tried by the homes.
+    :return: list of str
+    """
+    tried = []
+    solve_tier = MPCCalc.solve_tier
+    def solve(self, solver):
+        tried.append(solver)
+        if solver in failing:
+            self.solved = False
+            self.status = "solver_error"
+        else:
+            solve_tier(self, solver)
+    monkeypatch.setattr(MPCCalc, "solve_tier", solve)
+    return tried
+
+@pytest.mark.parametrize("n_failing", [0, 1, 2, 3])
+def test_solver_tiers_fall_back_in_order(community, monkeypatch, n_failing):
+    homes = community(home__hems={"solver": FALLBACK_SOLVERS[0], "fallback_solvers": FALLBACK_SOLVERS[1:]})
+    tried = fail_solvers(monkeypatch, FALLBACK_SOLVERS[:n_failing])
+    for home in homes:
+        assert home.solver_tiers == FALLBACK_SOLVERS
+        tried.clear()
+        home.solve_mpc()
+        assert tried == FALLBACK_SOLVERS[:n_failing + 1] # stops at the first tier with a solution
+        assert home.tier == n_failing # len(solver_tiers) for the rule based fallback
+        home.cleanup_and_finish()
+        if n_failing < len(FALLBACK_SOLVERS):
+            assert home.status in cp.settings.SOLUTION_PRESENT
+            assert home.optimal_vals["solve_tier"] == n_failing
+            assert home.optimal_vals["correct_solve"] == 1
+        else:
+            assert home.optimal_vals["correct_solve"] == 0
+
+def test_time_limited_solves_end_on_the_fallback(community):
+    homes = community(home__hems={"solver": FALLBACK_SOLVERS[0], "fallback_solvers": FALLBACK_SOLVERS[1:], "time_limit": 1e-4})
+    for home in homes:
+        home.solve_mpc()
+        assert home.status not in cp.settings.SOLUTION_PRESENT
+        assert home.tier == len(FALLBACK_SOLVERS)
+        home.cleanup_and_finish()
+        assert home.optimal_vals["correct_solve"] == 0
+
+def test_relaxed_solution_is_repaired(community):
+    homes = community(home__hems={"mode": "relaxed", "solver": "ECOS", "relaxed_gap_sample": 1})
+    for home in homes:
+        assert home.gap_check # every home is sampled
+        home.solve_mpc()
+        assert home.status in cp.settings.SOLUTION_PRESENT
+        for k in ["hvac_cool_on", "hvac_heat_on", "wh_heat_on"]: # integer duty cycles
+            duty_cycles = getattr(home, k).value
+            np.testing.assert_array_equal(duty_cycles, np.round(duty_cycles))
+        assert home.simulate_plan() # within the temperature bounds
+        home.check_relaxed_gap()
+        exact = SparseMILP(home)
+        exact.solve(options=home.solver_options("SCIPY_MILP"), set_values=False)
+        gap = (discounted_cost(home) - exact.objective) / max(abs(exact.objective), 1e-9)
+        assert home.optimal_vals["relaxed_gap"] == pytest.approx(gap)
+        assert gap >= -1e-6 # the repaired plan is feasible for the MILP
@@ -0,0 +1,137 @@
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+import redis
+
+from dragg import redis_client
+from dragg.redis_client import RedisClient
+from dragg.local_store import LocalStore
+from dragg.shared_data import publish_data, attach_data, release_data
+from dragg.executor import Executor
+
+def test_local_store_commands():
+    store = LocalStore()
+    store.hset("h", mapping={"a": 1, "b": 2})
+    assert store.hsetnx("h", "a", 3) is False
+    assert store.hgetall("h") == {"a": 1, "b": 2}
+    assert store.hmget("h", ["b", "c"]) == [2, None]
+    store.hincrbyfloat("totals", "p", 1.5)
+    store.hincrbyfloat("totals", "p", 2)
+    assert store.hget("totals", "p") == 3.5
+    store.rpush("l", 1, 2, 3)
+    assert store.lrange("l", 0, -1) == [1, 2, 3]
+    assert store.copy("h", "h:copy")
+    store.hset("h", "a", 5)
+    assert store.hget("h:copy", "a") == 1
+    assert sorted(store.scan_iter(match="h*")) == ["h", "h:copy"]
+    assert store.delete("h", "missing") == 1
+
+def test_local_store_counts_round_trips():
+    latencies = []
+    store = LocalStore(count=latencies.append)
+    store.hset("h", "a", 1)
+    store.hget("h", "a")
+    pipe = store.pipeline()
+    pipe.hset("h", "b", 2)
+    pipe.hgetall("h")
+    assert pipe.execute() == [1, {"a": 1, "b": 2}]
+    assert len(latencies) == 3 # one per command, one per executed pipeline
+
+def test_local_store_is_shared_by_threads():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # switch threads as often as possible
+    store = LocalStore()
+    n_threads, n = 8, 5000
+    claims = []
+    def home(i):
+        for _ in range(n):
+            store.hincrbyfloat("totals", "p", 1.0)
+            pipe = store.pipeline()
+            pipe.hincrbyfloat("totals", "a", 1.0)
+            pipe.hincrbyfloat("totals", "b", 1.0)
+            pipe.execute()
+        claims.append(store.hsetnx("claims", "home", i))
+    threads = [threading.Thread(target=home, args=(i,)) for i in range(n_threads)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert store.hgetall("totals") == {"p": n_threads * n, "a": n_threads * n, "b": n_threads * n}
+    assert sum(claims) == 1
+
+def test_shared_data():
+    df = pd.DataFrame({"GHI": [0.0, 1.0, 2.0], "OAT": [5.0, 6.0, 7.0]})
+    desc = publish_data(df, "dragg-test-shared-data")
+    try:
+        data = attach_data(desc)
+        np.testing.assert_array_equal(data["OAT"], [5.0, 6.0, 7.0])
+        assert attach_data(desc) is data # attached once per process
+    finally:
+        release_data(desc)
+
+def square(x):
+    return x * x
+
+def test_executor():
+    for backend in ["thread", "process"]:
+        executor = Executor(backend, n_workers=2, chunk_size=2)
+        try:
+            assert executor.map(square, range(5)) == [0, 1, 4, 9, 16]
+            assert executor.submit(square, 3).get() == 9
+        finally:
+            executor.close()
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    The RedisClient connected to an in-process fakeredis server.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    def pool(decode_responses=True):
+        return redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=server, decode_responses=decode_responses)
+    client = RedisClient()
+    transport, run_id = client.transport, client.run_id
+    monkeypatch.setattr(redis_client, "connection_pool", pool)
+    client.set_transport("redis")
+    client.setup_pools()
+    yield client
+    monkeypatch.undo()
+    client.setup_pools()
+    client.set_transport(transport)
+    client.run_id = run_id
+
+def test_run_ids_coexist(fake_redis):
+    conn = fake_redis.conn
+    conn.set("other", 1) # not written by a simulation
+    for run_id in ["run-a", "run-ab"]:
+        fake_redis.set_run_id(run_id)
+        conn.hset(fake_redis.key("home"), "temp_in_opt", run_id)
+        conn.set(fake_redis.key("start_hour_index"), 1)
+    fake_redis.set_run_id("run-a")
+    assert conn.hget(fake_redis.key("home"), "temp_in_opt") == "run-a"
+    fake_redis.delete_run_keys()
+    assert sorted(conn.scan_iter()) == ["other", "run-ab:home", "run-ab:start_hour_index"]
+    with pytest.raises(ValueError):
+        fake_redis.set_run_id("run:a") # would overlap the keys of other runs
+
+def test_flush_redis_only_deletes_the_keys_of_the_run(sim_dir, fake_redis):
+    from dragg.aggregator import Aggregator
+    conn = fake_redis.conn
+    conn.hset("other-run:home", "temp_in_opt", 20)
+    sim_dir(simulation={"transport": "redis", "run_id": "this-run"})
+    agg = Aggregator()
+    agg.flush_redis()
+    assert conn.hget("other-run:home", "temp_in_opt") == "20"
+    assert any(k.startswith("this-run:") for k in conn.scan_iter())
+    agg.release_environmental_data()
+    agg.flush_redis() # again, e.g. at the start of the next case
+    agg.release_environmental_data()
+    agg.redis_client.delete_run_keys()
+    assert list(conn.scan_iter()) == ["other-run:home"]
@@ -0,0 +1,69 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from dragg.aggregator import Aggregator
+
+def cache_files():
+    return sorted(glob.glob(os.path.join("outputs", "cache", "*.npz")))
+
+@pytest.fixture
+def csv_reads(monkeypatch):
+    """
+    Counts the parses of the NSRDB file.
+    """
+    reads = []
+    read_ts_csv = Aggregator._read_ts_csv
+    def spy(self):
+        reads.append(self.dt)
+        return read_ts_csv(self)
+    monkeypatch.setattr(Aggregator, "_read_ts_csv", spy)
+    return reads
+
+def test_cache_gives_the_parsed_data(sim_dir, csv_reads):
+    parsed = Aggregator().ts_data
+    assert len(cache_files()) == 1
+    assert not os.path.exists(os.path.join("data", "cache")) # the data directory is not written
+    agg = Aggregator()
+    assert csv_reads == [1] # read from the cache the second time
+    pd.testing.assert_frame_equal(agg.ts_data, parsed)
+    pd.testing.assert_frame_equal(agg.ts_data, agg._read_ts_csv())
+
+def test_cache_depends_on_the_subhourly_steps(sim_dir, csv_reads):
+    hourly = Aggregator().ts_data
+    sim_dir(agg={"subhourly_steps": 4})
+    agg = Aggregator()
+    assert csv_reads == [1, 4]
+    assert len(cache_files()) == 2
+    assert len(agg.ts_data) == 4 * len(hourly)
+    pd.testing.assert_frame_equal(Aggregator().ts_data, agg._read_ts_csv())
+
+def test_cache_is_invalidated_by_a_changed_file(sim_dir, csv_reads):
+    first = Aggregator().ts_data
+    with open(os.path.join("data", "nsrdb.csv")) as f:
+        lines = f.readlines()
+    fields = lines[3].split(",")
+    fields[7] = str(int(fields[7]) + 10) # Temperature of the first half hour
+    lines[3] = ",".join(fields)
+    with open(os.path.join("data", "nsrdb.csv"), "w") as f:
+        f.writelines(lines)
+    agg = Aggregator()
+    assert csv_reads == [1, 1]
+    assert len(cache_files()) == 2
+    assert agg.ts_data["OAT"].iloc[0] == first["OAT"].iloc[0] + 10
+    pd.testing.assert_frame_equal(agg.ts_data, agg._read_ts_csv())
+
+def test_cache_can_be_disabled(sim_dir, csv_reads):
+    sim_dir(simulation={"ts_cache": False})
+    Aggregator()
+    Aggregator()
+    assert csv_reads == [1, 1]
+    assert cache_files() == []
+
+def test_cache_dir(sim_dir, tmp_path):
+    sim_dir(simulation={"ts_cache_dir": str(tmp_path / "ts")})
+    Aggregator()
+    assert len(glob.glob(str(tmp_path / "ts" / "*.npz"))) == 1
+    assert cache_files() == []